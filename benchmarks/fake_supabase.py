@@ -0,0 +1,189 @@
+import datetime
+import itertools
+import random
+import sys
+import types
+from collections import Counter
+
+from fuda_index import ZONES, load_fuda_json
+from placement_codec import PlacementCodec
+from placement_trends import deck_metrics, day_of
+
+# 集計テーブル（sql/ のトリガーで更新されるもの）。保存時にここで同じように更新する
+SUMMARY_TABLES = ("karuta_fuda_position_counts", "karuta_placement_rollups")
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """supabase-py のクエリビルダーのうち、アプリが使う部分だけを真似たもの。"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.columns = None
+        self.filters = []
+        self.orders = []
+        self.bounds = None
+        self.max_rows = None
+        self.rows_to_insert = None
+
+    def select(self, columns="*"):
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) >= str(value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) < str(value))
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    def insert(self, rows, default_to_null=True):
+        self.rows_to_insert = rows if isinstance(rows, list) else [rows]
+        self.default_to_null = default_to_null
+        return self
+
+    def execute(self):
+        rows = self.client.tables.get(self.table)
+        if rows is None:
+            raise Exception(f'relation "{self.table}" does not exist')
+        if self.rows_to_insert is not None:
+            saved = self.client.insert_rows(self.table, self.rows_to_insert, self.default_to_null)
+            return FakeResponse([dict(r) for r in saved])
+
+        if self.filters:
+            rows = [r for r in rows if all(f(r) for f in self.filters)]
+        # karuta_decks は id 順（= 作成日時順）に並んでいるので、よく使う並び順は並べ替えずに返す
+        if self.orders == [("id", False)] or self.orders == [("created_at", False)]:
+            pass
+        elif self.orders == [("created_at", True)] and self.table == "karuta_decks":
+            rows = rows[::-1]
+        else:
+            for column, desc in reversed(self.orders):
+                rows = sorted(rows, key=lambda r: r[column], reverse=desc)
+        if self.bounds:
+            rows = rows[self.bounds[0]:self.bounds[1]]
+        if self.max_rows is not None:
+            rows = rows[:self.max_rows]
+        if self.columns:
+            return FakeResponse([{c: r.get(c) for c in self.columns} for r in rows])
+        return FakeResponse([dict(r) for r in rows])
+
+
+class FakeSupabaseClient:
+    """メモリ上だけで動く Supabase の代わり。
+
+    summary_tables=True のときは集計テーブルも持ち、保存のたびに
+    トリガーと同じ差分更新を行う（False なら集計テーブルがない状態を再現する）。
+    """
+
+    def __init__(self, summary_tables=True):
+        self.tables = {"karuta_decks": [], "karuta_recall_events": []}
+        self.ids = itertools.count(1)
+        self.position_counts = Counter()
+        self.rollups = Counter()
+        if summary_tables:
+            for name in SUMMARY_TABLES:
+                self.tables[name] = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def insert_rows(self, table, rows, default_to_null=True):
+        # PostgREST と同じく、default_to_null なら全行のキーを列にして、値のない列を NULL で送る
+        columns = set().union(*rows) if default_to_null else set()
+        saved = []
+        for row in rows:
+            row = dict.fromkeys(columns) | dict(row)
+            if table == "karuta_decks":
+                if 'created_at' not in row:
+                    row['created_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                elif row['created_at'] is None:
+                    # 1行でも NOT NULL に反すれば、まとめて送った行はすべて保存されない
+                    raise Exception('null value in column "created_at" of relation "karuta_decks" violates not-null constraint')
+            saved.append(row)
+        for row in saved:
+            if table == "karuta_decks":
+                row['id'] = next(self.ids)
+            self.tables[table].append(row)
+        if table == "karuta_decks" and "karuta_fuda_position_counts" in self.tables:
+            self._apply_summaries(saved)
+        return saved
+
+    def _apply_summaries(self, decks):
+        codec = PlacementCodec.default()
+        for deck in decks:
+            # トリガーと同じく、JSON の列がなければ配置コードから戻す
+            placement = deck.get('placement') or codec.decode(deck['placement_code'])[0]
+            for pos in ZONES:
+                for fuda in placement.get(pos, []):
+                    self.position_counts[(fuda, pos)] += 1
+            day = day_of(deck['created_at'])
+            for metric, value in deck_metrics(placement).items():
+                self.rollups[(day, metric)] += value
+        self.tables["karuta_fuda_position_counts"] = [
+            {"fuda": f, "position": p, "count": n} for (f, p), n in self.position_counts.items()
+        ]
+        self.tables["karuta_placement_rollups"] = [
+            {"day": d, "metric": m, "value": v} for (d, m), v in sorted(self.rollups.items())
+        ]
+
+
+def random_deck(rng, kimariji, name):
+    # 配置コードに移行済みの行（sql/karuta_decks_placement_code.sql の実行後）と同じ形
+    cards = rng.sample(kimariji, 25)
+    placement = {}
+    start = 0
+    for z, size in zip(ZONES, (4, 4, 4, 4, 4, 5)):
+        placement[z] = cards[start:start + size]
+        start += size
+    return {"deck_name": name, "placement_code": PlacementCodec.default().encode(placement, cards)}
+
+
+def seed_decks(client, n, seed=0, days=730):
+    """ランダムな配置を n 件、過去 days 日に均等に散らばった作成日時で保存する。"""
+    rng = random.Random(seed)
+    kimariji = [f['kimariji'] for f in load_fuda_json()]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    decks = []
+    for i in range(n):
+        created_at = (now - datetime.timedelta(days=days * (n - i) / n)).isoformat()
+        decks.append(dict(random_deck(rng, kimariji, f"seed-{i}"), id=next(client.ids), created_at=created_at))
+    client.tables["karuta_decks"].extend(decks)
+    if "karuta_fuda_position_counts" in client.tables:
+        client._apply_summaries(decks)
+    return decks
+
+
+def install(client):
+    # アプリの `from supabase import create_client` がこのクライアントを返すようにする
+    module = types.ModuleType("supabase")
+    module.create_client = lambda url, key: client
+    sys.modules["supabase"] = module
+    return client
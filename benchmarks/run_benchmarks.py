@@ -0,0 +1,270 @@
+"""streamlit_app.py を AppTest でヘッドレスに操作し、再実行ごとの処理時間とメモリを測る。
+
+    python benchmarks/run_benchmarks.py --decks 10,1000,100000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json benchmarks/results/new.json
+
+保存先はメモリ上の Supabase の代わり（fake_supabase.py）を使うので、接続情報は不要。
+結果はコミットのハッシュ付きの JSON で保存し、--compare でコミット間の差を表示する。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from deck_transfer import import_decks
+from fake_supabase import FakeSupabaseClient, install, seed_decks
+from fuda_index import FudaIndex, ZONES, load_fuda_json
+from storage import SupabaseStorage
+
+APP_PATH = os.path.join(ROOT, "streamlit_app.py")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DEFAULT_DECKS = "10,100,1000,10000,100000"
+ROW_SIZES = (4, 4, 4, 4, 4, 5)
+# 札の選択画面の行（streamlit_app.py の FUDA_GROUPS と同じ）
+FUDA_GROUPS = {
+    "あ行": "あいうえお", "か・さ行": "かきくけこさしすせそ", "た・な行": "たちつてとなにぬねの",
+    "は・ま行": "はひふへほまみむめも", "や・ら・わ行": "やゆよらりるれろわ"
+}
+
+
+class StepRecorder:
+    """操作1回（= 再実行1回）ごとの処理時間と、その間に増えたメモリの最大値を記録する。"""
+
+    def __init__(self, app, track_memory):
+        self.app = app
+        self.track_memory = track_memory
+        self.steps = []
+
+    def run(self, name, action):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        action()
+        seconds = time.perf_counter() - start
+        peak_kib = None
+        if self.track_memory:
+            peak_kib = (tracemalloc.get_traced_memory()[1] - before) / 1024
+        if self.app.exception:
+            raise RuntimeError(f"{name}: {self.app.exception[0].message}")
+        self.steps.append({"step": name, "seconds": seconds, "peak_kib": peak_kib})
+
+    def summary(self):
+        # 同じ名前の操作（25枚の選択など）はまとめて平均・最大を出す
+        grouped = {}
+        for s in self.steps:
+            grouped.setdefault(s['step'], []).append(s)
+        result = []
+        for name, runs in grouped.items():
+            ms = [r['seconds'] * 1000 for r in runs]
+            peaks = [r['peak_kib'] for r in runs if r['peak_kib'] is not None]
+            result.append({
+                "step": name,
+                "reruns": len(runs),
+                "mean_ms": round(statistics.mean(ms), 2),
+                "median_ms": round(statistics.median(ms), 2),
+                "max_ms": round(max(ms), 2),
+                "peak_kib": round(max(peaks), 1) if peaks else None,
+            })
+        return result
+
+
+def click(app, label):
+    for button in app.button:
+        if button.label == label:
+            return button.click().run()
+    raise RuntimeError(f"ボタンが見つかりません: {label}")
+
+
+def import_mixed_decks(client, n=20, seed=0):
+    """作成日時のある行とない行をまとめてインポートし、1件でも失敗したら止める。"""
+    rng = random.Random(seed)
+    kimariji = [f['kimariji'] for f in load_fuda_json()]
+    records = []
+    for i in range(n):
+        cards = rng.sample(kimariji, 25)
+        placement = {}
+        start = 0
+        for zone, size in zip(ZONES, ROW_SIZES):
+            placement[zone] = cards[start:start + size]
+            start += size
+        record = {"deck_name": f"import-{i}", "placement": placement}
+        if i % 2:
+            record["created_at"] = "2024-01-02T03:04:05+09:00"
+        records.append((i + 1, record))
+    report = import_decks(SupabaseStorage(client), records, backoff=0)
+    if report["errors"]:
+        raise RuntimeError(f"import: {report['errors'][0][1]}")
+    return report
+
+
+def benchmark_flows(n_decks, seed=0, track_memory=True, timeout=600):
+    """主な操作の流れ（札の選択 → 配置 → 保存 → 診断 → 送り札 → 分析 → 暗記テスト → ドリル）を1回通して測る。"""
+    client = install(FakeSupabaseClient())
+    seed_decks(client, n_decks, seed=seed)
+    import_mixed_decks(client, seed=seed)
+    # キャッシュはプロセス全体で共有されるので、件数を変えるたびに空にする
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.secrets["SUPABASE_URL"] = "http://fake"
+    app.secrets["SUPABASE_KEY"] = "fake"
+    recorder = StepRecorder(app, track_memory)
+
+    # 各タブ（1字目の音）から満遍なく選ぶ
+    index = FudaIndex(load_fuda_json())
+    cards = index.cards[::len(index) // 25][:25]
+    placement = {}
+    start = 0
+    for zone, size in zip(ZONES, ROW_SIZES):
+        placement[zone] = [f['kimariji'] for f in cards[start:start + size]]
+        start += size
+
+    recorder.run("startup", app.run)
+    for f in cards:
+        group = next(g for g, chars in FUDA_GROUPS.items() if f['kimariji'][0] in chars)
+        if app.radio(key="fuda_group").value != group:
+            recorder.run("select_group", lambda: app.radio(key="fuda_group").set_value(group).run())
+        recorder.run("select", lambda: app.checkbox(key=f"select_{f['id']}").check().run())
+    recorder.run("search", lambda: app.text_input(key="fuda_search").input("ころもて").run())
+    for zone in ZONES:
+        recorder.run("place", lambda: app.multiselect(key=zone).set_value(placement[zone]).run())
+    deck_name = next(t for t in app.text_input if t.label == "配置名")
+    recorder.run("save_name", lambda: deck_name.input("ベンチマーク").run())
+    recorder.run("save", lambda: click(app, "保存する"))
+    if not any(m.value.startswith("保存しました") for m in app.success):
+        raise RuntimeError("save: 配置を保存できませんでした")
+    recorder.run("diagnosis", lambda: app.multiselect(key="read_history").set_value(placement["l_top"][:2]).run())
+    opponent = [f['kimariji'] for f in index.cards if f not in cards]
+    for zone, size in zip(ZONES, ROW_SIZES):
+        recorder.run("opponent", lambda: app.multiselect(key=f"opp_{zone}").set_value(opponent[:size]).run())
+        opponent = opponent[size:]
+    for _ in range(5):
+        recorder.run("okurifuda_send", lambda: click(app, "送る"))
+    recorder.run("analysis", lambda: next(c for c in app.checkbox if c.label.startswith("保存データから")).check().run())
+    recorder.run("memory_start", lambda: click(app, "暗記スタート！ (配置を表示)"))
+    recorder.run("memory_test", lambda: click(app, "テスト開始！ (配置を隠す)"))
+    for zone, key in zip(ZONES, ("ans_lt", "ans_lm", "ans_ll", "ans_rt", "ans_rm", "ans_rl")):
+        recorder.run("memory_answer", lambda: app.multiselect(key=key).set_value(placement[zone]).run())
+    recorder.run("memory_check", lambda: click(app, "答え合わせ"))
+    recorder.run("drill_start", lambda: click(app, "ドリル（苦手な札から5問）"))
+    for _ in range(5):
+        recorder.run("drill_answer", lambda: app.button(key="drill_l_top").click().run())
+    return recorder.summary()
+
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def warm_up(timeout=600):
+    # 最初の計測にだけライブラリの読み込み時間が入らないよう、空の保存先で一度実行しておく
+    install(FakeSupabaseClient())
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.secrets["SUPABASE_URL"] = "http://fake"
+    app.secrets["SUPABASE_KEY"] = "fake"
+    app.run()
+
+
+def run(deck_counts, seed, track_memory, output):
+    warm_up()
+    if track_memory:
+        tracemalloc.start()
+    results = []
+    for n in deck_counts:
+        print(f"saved decks: {n}", file=sys.stderr)
+        results.append({"decks": n, "steps": benchmark_flows(n, seed, track_memory)})
+
+    report = {
+        "git": git_info(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "streamlit": st.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        # tracemalloc は処理時間も遅くするので、計測条件として残しておく
+        "tracemalloc": track_memory,
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{(report['git']['commit'] or 'unknown')[:10]}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"saved: {output}", file=sys.stderr)
+
+
+def print_report(report):
+    print(f"commit {report['git']['commit']}{' (dirty)' if report['git']['dirty'] else ''}")
+    print(f"{'decks':>7} {'step':<14} {'reruns':>6} {'mean_ms':>9} {'max_ms':>9} {'peak_kib':>10}")
+    for result in report['results']:
+        for s in result['steps']:
+            peak = "-" if s['peak_kib'] is None else f"{s['peak_kib']:.1f}"
+            print(f"{result['decks']:>7} {s['step']:<14} {s['reruns']:>6} {s['mean_ms']:>9.1f} {s['max_ms']:>9.1f} {peak:>10}")
+
+
+def compare(base_path, new_path):
+    # 2つの結果（別々のコミットで測ったもの）の平均処理時間とメモリを並べる
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    if base['tracemalloc'] != new['tracemalloc']:
+        print("warning: tracemalloc の設定が異なるため、処理時間はそのまま比べられません", file=sys.stderr)
+
+    base_steps = {(r['decks'], s['step']): s for r in base['results'] for s in r['steps']}
+    print(f"base {base['git']['commit']} -> new {new['git']['commit']}")
+    print(f"{'decks':>7} {'step':<14} {'base_ms':>9} {'new_ms':>9} {'change':>8} {'base_kib':>10} {'new_kib':>10}")
+    for result in new['results']:
+        for s in result['steps']:
+            b = base_steps.get((result['decks'], s['step']))
+            if b is None:
+                continue
+            change = (s['mean_ms'] - b['mean_ms']) / b['mean_ms'] * 100 if b['mean_ms'] else 0.0
+            base_kib = "-" if b['peak_kib'] is None else f"{b['peak_kib']:.1f}"
+            new_kib = "-" if s['peak_kib'] is None else f"{s['peak_kib']:.1f}"
+            print(f"{result['decks']:>7} {s['step']:<14} {b['mean_ms']:>9.1f} {s['mean_ms']:>9.1f} {change:>+7.1f}% {base_kib:>10} {new_kib:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="streamlit_app.py のヘッドレス・ベンチマーク")
+    parser.add_argument("--decks", default=DEFAULT_DECKS, help="保存済みデッキの件数（カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc によるメモリ計測をしない")
+    parser.add_argument("--output", help="結果の JSON（既定は benchmarks/results/<コミット>.json）")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="2つの結果の JSON を比べる")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run([int(n) for n in args.decks.split(",")], args.seed, not args.no_memory, args.output)
+
+
+if __name__ == "__main__":
+    main()
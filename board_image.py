@@ -0,0 +1,121 @@
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from fuda_index import ZONES, ZONE_LABELS
+
+# 日本語を描画できるフォントの候補（packages.txt の fonts-noto-cjk など）
+FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "/usr/share/fonts/truetype/takao-gothic/TakaoGothic.ttf",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "C:/Windows/Fonts/meiryo.ttc",
+)
+
+TILE_W, TILE_H = 56, 120
+GLYPH_SIZE = 24
+GAP = 8
+MARGIN = 16
+LABEL_H = 24
+MAX_TILES_PER_ROW = 8
+BACKGROUND = (245, 240, 225)
+TILE_FILL = (255, 253, 245)
+TILE_BORDER = (60, 90, 60)
+INK = (30, 30, 30)
+
+
+@lru_cache(maxsize=4)
+def load_font(size, path=None):
+    path = path or os.environ.get("KARUTA_FONT_PATH")
+    for candidate in ((path,) if path else ()) + FONT_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            return ImageFont.truetype(candidate, size)
+    # 日本語フォントが見つからない場合（文字は表示されないことがある）
+    return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=256)
+def render_glyph(ch, size=GLYPH_SIZE):
+    # 1文字分の画像。同じ文字は一度だけ描画する
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text((size // 2, size // 2), ch, font=load_font(size), fill=INK, anchor="mm")
+    return image
+
+
+@lru_cache(maxsize=256)
+def render_tile(text):
+    # 札1枚分の画像（決まり字を縦書きにする）。同じ札は一度だけ描画する
+    tile = Image.new("RGB", (TILE_W, TILE_H), TILE_FILL)
+    ImageDraw.Draw(tile).rectangle((0, 0, TILE_W - 1, TILE_H - 1), outline=TILE_BORDER, width=3)
+    step = min(GLYPH_SIZE, (TILE_H - 16) // max(len(text), 1))
+    top = (TILE_H - step * len(text)) // 2
+    for i, ch in enumerate(text):
+        glyph = render_glyph(ch)
+        if step < GLYPH_SIZE:
+            glyph = glyph.resize((step, step))
+        tile.paste(glyph, ((TILE_W - glyph.width) // 2, top + i * step), glyph)
+    return tile
+
+
+@lru_cache(maxsize=64)
+def render_label(text):
+    font = load_font(16)
+    image = Image.new("RGBA", (int(font.getlength(text)) + 4, LABEL_H), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text((0, LABEL_H // 2), text, font=font, fill=INK, anchor="lm")
+    return image
+
+
+def render_board(placement, title=None):
+    """6つの段（左右 × 上中下）の配置を1枚の画像にする。上が相手側。"""
+    side_w = MAX_TILES_PER_ROW * (TILE_W + GAP) - GAP
+    for zone in ZONES:
+        side_w = max(side_w, len(placement.get(zone, [])) * (TILE_W + GAP) - GAP)
+    row_h = LABEL_H + TILE_H + GAP
+    title_h = LABEL_H + GAP if title else 0
+    width = MARGIN * 3 + side_w * 2
+    height = MARGIN * 2 + title_h + row_h * 3
+
+    board = Image.new("RGB", (width, height), BACKGROUND)
+    if title:
+        label = render_label(title)
+        board.paste(label, (MARGIN, MARGIN), label)
+
+    for z, zone in enumerate(ZONES):
+        side, tier = divmod(z, 3)
+        x0 = MARGIN + side * (side_w + MARGIN)
+        y0 = MARGIN + title_h + tier * row_h
+        label = render_label(ZONE_LABELS[zone])
+        board.paste(label, (x0, y0), label)
+        for i, fuda in enumerate(placement.get(zone, [])):
+            board.paste(render_tile(fuda), (x0 + i * (TILE_W + GAP), y0 + LABEL_H))
+    return board
+
+
+def board_bytes(placement, title=None, fmt="PNG"):
+    fmt = "JPEG" if fmt.upper() in ("JPG", "JPEG") else fmt.upper()
+    buf = io.BytesIO()
+    render_board(placement, title).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _deck_file(args):
+    deck, fmt = args
+    name = f"{deck['id']}_{deck['deck_name']}".replace("/", "_")
+    title = f"{deck['deck_name']} ({str(deck.get('created_at', ''))[:10]})"
+    return f"{name}.{fmt.lower()}", board_bytes(deck['placement'], title, fmt)
+
+
+def export_zip(decks, fmt="PNG", workers=4):
+    """複数のデッキを画像にして ZIP にまとめる（描画はスレッドプールで並列に行う）。"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for filename, data in pool.map(_deck_file, ((deck, fmt) for deck in decks)):
+                zf.writestr(filename, data)
+    return buf.getvalue()
@@ -0,0 +1,82 @@
+import threading
+from array import array
+
+import numpy as np
+
+from fuda_index import ZONES
+
+
+class PlacementVectorIndex:
+    """保存済み配置を「札 × 位置」（100 × 6 = 600 次元）の 0/1 ベクトルとして扱う近傍探索用の索引。
+
+    ベクトルは1デッキあたり25個しか 1 を持たないので、特徴（札 × 位置）ごとに
+    その特徴を持つデッキの行番号を並べた転置リストで保持する。
+    類似度は 0/1 ベクトルのコサイン類似度（一致した札 × 位置の数 / √(枚数 × 枚数)）。
+    アプリでは全セッションで1つの索引を共有するので、追加と検索はロックを取って行う
+    （検索中の np.frombuffer の参照があるうちは array に追加できない）。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.n_features = len(index) * len(ZONES)
+        self.postings = [array('q') for _ in range(self.n_features)]
+        self.deck_ids = []
+        self.deck_names = []
+        self.created_at = []
+        self.sizes = array('q')
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.deck_ids)
+
+    def features(self, placement):
+        result = []
+        for z, zone in enumerate(ZONES):
+            for k in placement.get(zone, []):
+                i = self.index.position.get(k)
+                if i is not None:
+                    result.append(i * len(ZONES) + z)
+        return result
+
+    def add(self, deck_id, placement, deck_name="", created_at=""):
+        # 保存されたデッキを1件ずつ追加する（索引を作り直さない）
+        feats = self.features(placement)
+        with self.lock:
+            row = len(self.deck_ids)
+            for f in feats:
+                self.postings[f].append(row)
+            self.deck_ids.append(deck_id)
+            self.deck_names.append(deck_name)
+            self.created_at.append(str(created_at or ""))
+            self.sizes.append(len(feats))
+
+    @classmethod
+    def from_decks(cls, index, decks):
+        vector_index = cls(index)
+        for deck in decks:
+            vector_index.add(deck['id'], deck['placement'], deck.get('deck_name', ""), deck.get('created_at', ""))
+        return vector_index
+
+    def query(self, placement, k=5):
+        """似ている順に {"id", "deck_name", "created_at", "similarity"} を最大 k 件返す。"""
+        feats = self.features(placement)
+        with self.lock:
+            n = len(self.deck_ids)
+            if n == 0 or not feats:
+                return []
+            hits = [np.frombuffer(self.postings[f], dtype=np.int64) for f in feats if len(self.postings[f])]
+            if not hits:
+                return []
+            overlap = np.bincount(np.concatenate(hits), minlength=n).astype(np.float64)
+            sizes = np.frombuffer(self.sizes, dtype=np.int64)
+            similarity = overlap / np.sqrt(np.maximum(sizes, 1) * len(feats))
+            # 配列の参照をロックの中で手放す
+            del hits, sizes
+            k = min(k, n)
+            top = np.argpartition(-similarity, k - 1)[:k]
+            top = top[np.argsort(-similarity[top], kind="stable")]
+            return [
+                {"id": self.deck_ids[r], "deck_name": self.deck_names[r], "created_at": self.created_at[r],
+                 "similarity": float(similarity[r])}
+                for r in top if similarity[r] > 0
+            ]
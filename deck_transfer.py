@@ -0,0 +1,232 @@
+"""保存済み配置の一括インポート・エクスポート（NDJSON / CSV）。
+
+    python deck_transfer.py import decks.csv
+    python deck_transfer.py export --format ndjson --output decks.ndjson
+
+保存先は環境変数（STORAGE_BACKEND, SUPABASE_URL, SUPABASE_KEY, SQLITE_PATH）で選ぶ。
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import sys
+import time
+
+from fuda_index import FudaIndex, ZONES, load_fuda_json
+from placement_codec import PlacementCodec
+
+FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = ("deck_name", "created_at") + ZONES
+# CSV のセルの中の札の区切り（スプレッドシートで入力しやすいものを受け付ける）
+CARD_SEPARATOR = re.compile(r"[\s,、・|/]+")
+CHUNK_SIZE = 200
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+
+
+class DeckValidationError(ValueError):
+    pass
+
+
+def format_of(filename):
+    return "csv" if filename.lower().endswith(".csv") else "ndjson"
+
+
+def read_records(stream, fmt):
+    """テキストのストリームから (行番号, レコード) を1件ずつ読む。"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, DeckValidationError(f"JSON として読めません: {e.msg}")
+
+
+def validate_deck(record, index, codec):
+    """レコードを保存できるデッキ {"deck_name", "selected_fuda", "placement", "created_at"} にする。
+
+    札はすべて fuda.json の決まり字で、6つの段に重複なく合計25枚あることを確かめる。
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise DeckValidationError("レコードの形式が正しくありません")
+
+    deck_name = str(record.get('deck_name') or "").strip()
+    if not deck_name:
+        raise DeckValidationError("deck_name がありません")
+
+    if record.get('placement_code'):
+        try:
+            placement, _ = codec.decode(record['placement_code'])
+        except (ValueError, KeyError, TypeError):
+            raise DeckValidationError("placement_code が正しくありません")
+    elif isinstance(record.get('placement'), dict):
+        placement = {}
+        for zone in ZONES:
+            cards = record['placement'].get(zone) or []
+            if not isinstance(cards, list) or not all(isinstance(k, str) for k in cards):
+                raise DeckValidationError(f"{zone} は決まり字（文字列）のリストで指定してください")
+            placement[zone] = cards
+    else:
+        # CSV：段ごとの列に札を区切って並べる
+        placement = {zone: [k for k in CARD_SEPARATOR.split(record.get(zone) or "") if k] for zone in ZONES}
+
+    cards = [k for zone in ZONES for k in placement[zone]]
+    unknown = [k for k in cards if k not in index.position]
+    if unknown:
+        raise DeckValidationError(f"不明な札があります: {', '.join(unknown)}")
+    if len(set(cards)) != len(cards):
+        raise DeckValidationError("同じ札が2回以上置かれています")
+    if len(cards) != 25:
+        raise DeckValidationError(f"札が {len(cards)} 枚です（25枚必要です）")
+
+    # 日時は UTC にそろえる（保存先の既定値・日ごとの集計が UTC の日付で区切るため）。タイムゾーンのない日時は UTC とみなす
+    created_at = record.get('created_at') or None
+    if created_at:
+        try:
+            value = datetime.datetime.fromisoformat(str(created_at))
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            created_at = value.astimezone(datetime.timezone.utc).isoformat()
+        except (ValueError, OverflowError):
+            raise DeckValidationError(f"created_at が日時として読めません: {created_at}")
+    return {"deck_name": deck_name, "selected_fuda": cards, "placement": placement, "created_at": created_at}
+
+
+def insert_with_retry(storage, decks, retries=RETRIES, backoff=BACKOFF_SECONDS, sleep=time.sleep):
+    # 通信エラーなどで失敗したら、待ち時間を倍にしながら retries 回までやり直す
+    for attempt in range(retries + 1):
+        try:
+            return storage.insert_decks(decks)
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(backoff * 2 ** attempt)
+
+
+def import_decks(storage, records, index=None, chunk_size=CHUNK_SIZE, retries=RETRIES,
+                 backoff=BACKOFF_SECONDS, progress=None):
+    """レコードを読みながら検証し、chunk_size 件ずつまとめて保存する。
+
+    すでに保存されている配置とファイル内で重複する配置は保存しない。
+    progress(読んだ件数, 保存した件数, エラー件数) を1チャンクごとに呼ぶ。
+    戻り値は {"read", "imported", "skipped", "errors": [(行番号, 理由)]}。
+    """
+    index = index or FudaIndex(load_fuda_json())
+    codec = PlacementCodec(index)
+    report = {"read": 0, "imported": 0, "skipped": 0, "errors": []}
+    seen = set()
+    chunk = []
+
+    def flush():
+        codes = [code for _, code, _ in chunk]
+        existing = storage.existing_codes(codes)
+        decks = [deck for _, code, deck in chunk if code not in existing]
+        report["skipped"] += len(chunk) - len(decks)
+        if decks:
+            try:
+                insert_with_retry(storage, decks, retries, backoff)
+                report["imported"] += len(decks)
+            except Exception as e:
+                report["errors"].extend(
+                    (line_no, f"保存に失敗しました: {e}") for line_no, code, _ in chunk if code not in existing
+                )
+        chunk.clear()
+        if progress:
+            progress(report["read"], report["imported"], len(report["errors"]))
+
+    for line_no, record in records:
+        report["read"] += 1
+        try:
+            deck = validate_deck(record, index, codec)
+        except DeckValidationError as e:
+            report["errors"].append((line_no, str(e)))
+            continue
+        code = codec.encode(deck['placement'], deck['selected_fuda'])
+        if code in seen:
+            report["skipped"] += 1
+            continue
+        seen.add(code)
+        chunk.append((line_no, code, deck))
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    return report
+
+
+def export_lines(decks, fmt):
+    """デッキを1件ずつ NDJSON / CSV の行にする（保存先の iter_decks と組み合わせてページ単位で読む）。"""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(CSV_COLUMNS)
+        for deck in decks:
+            rows = [" ".join(deck['placement'].get(z, [])) for z in ZONES]
+            writer.writerow([deck['deck_name'], deck.get('created_at') or ""] + rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    else:
+        for deck in decks:
+            yield json.dumps({
+                "deck_name": deck['deck_name'],
+                "created_at": deck.get('created_at'),
+                "placement": {z: deck['placement'].get(z, []) for z in ZONES},
+                "placement_code": deck.get('placement_code'),
+            }, ensure_ascii=False) + "\n"
+
+
+def main():
+    from storage import open_storage
+
+    parser = argparse.ArgumentParser(description="保存済み配置の一括インポート・エクスポート")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="NDJSON / CSV のファイルから保存する")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=FORMATS)
+    p_import.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    p_export = sub.add_parser("export", help="保存済みの配置を書き出す")
+    p_export.add_argument("--format", choices=FORMATS, default="ndjson")
+    p_export.add_argument("--output", help="書き出し先（既定は標準出力）")
+    args = parser.parse_args()
+
+    storage = open_storage({
+        name: os.environ.get(name)
+        for name in ("STORAGE_BACKEND", "SUPABASE_URL", "SUPABASE_KEY", "SQLITE_PATH")
+    })
+    if args.command == "import":
+        def progress(read, imported, errors):
+            print(f"\r読み込み {read} 件 / 保存 {imported} 件 / エラー {errors} 件", end="", file=sys.stderr)
+
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            report = import_decks(
+                storage, read_records(f, args.format or format_of(args.path)),
+                chunk_size=args.chunk_size, progress=progress
+            )
+        print(file=sys.stderr)
+        for line_no, message in report["errors"]:
+            print(f"{args.path}:{line_no}: {message}", file=sys.stderr)
+        print(f"保存 {report['imported']} 件、重複のため省略 {report['skipped']} 件、エラー {len(report['errors'])} 件", file=sys.stderr)
+    else:
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for line in export_lines(storage.iter_decks(), args.format):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
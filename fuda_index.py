@@ -0,0 +1,84 @@
+import json
+import os
+
+# 自陣の6つのエリア（streamlit_app.py の session_state のキーと同じ並び）
+ZONES = ("l_top", "l_mid", "l_low", "r_top", "r_mid", "r_low")
+ZONE_LABELS = {
+    "l_top": "左上段", "l_mid": "左中段", "l_low": "左下段",
+    "r_top": "右上段", "r_mid": "右中段", "r_low": "右下段"
+}
+
+
+def load_fuda_json(file_path=None):
+    if file_path is None:
+        file_path = os.path.join(os.path.dirname(__file__), 'fuda.json')
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class FudaIndex:
+    """fuda.json から一度だけ作る札の索引。
+
+    札は決まり字順に並べ、その並び順を札番号（ビット位置）として使う。
+    札の集合は Python の int をビット集合として表す。
+    """
+
+    def __init__(self, fuda_list):
+        self.cards = sorted(fuda_list, key=lambda x: x['kimariji'])
+        self.kimariji = [f['kimariji'] for f in self.cards]
+        self.types = [f['type'] for f in self.cards]
+        self.position = {k: i for i, k in enumerate(self.kimariji)}
+        self.bits = [1 << i for i in range(len(self.cards))]
+        self.all_mask = (1 << len(self.cards)) - 1
+
+        # 決まり字の字数ごとの札
+        self.type_masks = {}
+        for i, t in enumerate(self.types):
+            self.type_masks[t] = self.type_masks.get(t, 0) | self.bits[i]
+
+        # 同じ音から始まる札（友札候補）
+        self.sound_masks = {}
+        for i, k in enumerate(self.kimariji):
+            self.sound_masks[k[0]] = self.sound_masks.get(k[0], 0) | self.bits[i]
+        self.tomo_masks = tuple(m for m in self.sound_masks.values() if m.bit_count() > 1)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def common_prefix_lengths(self):
+        # 札どうしの決まり字の共通部分の字数（100 × 100）。
+        # 決まり字はどれも他の札の決まり字の先頭部分ではないので、上の句の先頭の一致字数と等しい
+        table = []
+        for a in self.kimariji:
+            row = []
+            for b in self.kimariji:
+                n = 0
+                if a != b:
+                    while n < min(len(a), len(b)) and a[n] == b[n]:
+                        n += 1
+                row.append(n)
+            table.append(row)
+        return table
+
+    def mask_of(self, kimariji_list):
+        # 未知の決まり字は無視する
+        mask = 0
+        for k in kimariji_list:
+            i = self.position.get(k)
+            if i is not None:
+                mask |= self.bits[i]
+        return mask
+
+    def names_of(self, mask):
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.kimariji[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+    def cards_of(self, mask):
+        # ビット集合の札（fuda.json の辞書）を札番号の順に返す
+        return [self.cards[self.position[k]] for k in self.names_of(mask)]
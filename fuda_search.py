@@ -0,0 +1,80 @@
+import unicodedata
+
+# 検索の対象にする札の項目
+SEARCH_FIELDS = ("kimariji", "kami", "shimo", "shimo_kana")
+CACHE_SIZE = 1024
+
+
+def normalize(text):
+    """検索用に表記をそろえる（全角・半角、カタカナ → ひらがな、濁点・半濁点を外す、空白を除く）。
+
+    fuda.json の shimo_kana は濁点なしで書かれているので、「みれば」でも「みれは」でも見つかるようにする。
+    """
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    chars = []
+    for ch in unicodedata.normalize("NFD", text):
+        if ch in "\u3099\u309a" or ch.isspace():
+            continue
+        if "ァ" <= ch <= "ヶ":
+            ch = chr(ord(ch) - 0x60)
+        chars.append(ch)
+    return unicodedata.normalize("NFC", "".join(chars))
+
+
+class FudaSearchIndex:
+    """決まり字・上の句・下の句で札を探すための 1-gram / 2-gram の転置索引。
+
+    文字（または2文字の組）ごとに、それを含む札のビット集合（FudaIndex の札番号）を持つ。
+    検索語の2文字の組をすべて含む札に絞ってから、本当に含むかどうかを確かめる。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.texts = []
+        self.grams = {}
+        for i, card in enumerate(index.cards):
+            fields = [normalize(card[field]) for field in SEARCH_FIELDS if card.get(field)]
+            self.texts.append(fields)
+            for text in fields:
+                for n in (1, 2):
+                    for j in range(len(text) - n + 1):
+                        gram = text[j:j + n]
+                        self.grams[gram] = self.grams.get(gram, 0) | index.bits[i]
+        self.cache = {}
+
+    def candidates(self, query):
+        # 検索語の 2-gram（1文字なら 1-gram）をすべて含む札のビット集合
+        n = 2 if len(query) >= 2 else 1
+        mask = self.index.all_mask
+        for j in range(len(query) - n + 1):
+            mask &= self.grams.get(query[j:j + n], 0)
+            if not mask:
+                break
+        return mask
+
+    def search_mask(self, query):
+        """検索語を含む札のビット集合。空の検索語ならすべての札。"""
+        query = normalize(query)
+        if not query:
+            return self.index.all_mask
+        if query not in self.cache:
+            mask = 0
+            candidates = self.candidates(query)
+            while candidates:
+                low = candidates & -candidates
+                i = low.bit_length() - 1
+                if any(query in text for text in self.texts[i]):
+                    mask |= low
+                candidates ^= low
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            self.cache[query] = mask
+        return self.cache[query]
+
+    def search(self, query, mask=None):
+        """検索語を含む札（fuda.json の辞書）を、決まり字がその語で始まる札から順に返す。"""
+        found = self.search_mask(query)
+        if mask is not None:
+            found &= mask
+        q = normalize(query)
+        return sorted(self.index.cards_of(found), key=lambda f: not normalize(f['kimariji']).startswith(q))
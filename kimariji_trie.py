@@ -0,0 +1,97 @@
+class KimarijiTrie:
+    """決まり字のトライ木（札の索引ごとに一度だけ作る読み取り専用の構造）。
+
+    fuda.json の決まり字はどれも他の札の決まり字の先頭部分になっていないので、
+    決まり字どうしの共通部分から「上の句の先頭が何字まで一致するか」が分かる。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        children = [{}]
+        depths = [0]
+        self.paths = []
+        for k in index.kimariji:
+            node = 0
+            path = []
+            for ch in k:
+                nxt = children[node].get(ch)
+                if nxt is None:
+                    nxt = len(children)
+                    children.append({})
+                    depths.append(depths[node] + 1)
+                    children[node][ch] = nxt
+                node = nxt
+                path.append(node)
+            self.paths.append(tuple(path))
+        self.children = children
+        self.depths = depths
+
+        # 各ノードを通る札の枚数と札番号の合計
+        self.base_counts = [0] * len(children)
+        self.base_sums = [0] * len(children)
+        for i, path in enumerate(self.paths):
+            for node in path:
+                self.base_counts[node] += 1
+                self.base_sums[node] += i
+        self.base_lengths = [len(k) for k in index.kimariji]
+
+    def engine(self, in_play=(), read_history=()):
+        return KimarijiEngine(self, in_play, read_history)
+
+
+class KimarijiEngine:
+    """場にある札と読まれた札の履歴から、残りの札の現在の決まり字を返す。
+
+    各ノードに「まだ読まれていない札」の枚数と札番号の合計を持たせ、
+    枚数が1になった最も浅いノードまでの字数をその札の決まり字とする。
+    決まり字は読まれていない札すべて（空札を含む）に対して決まる。
+    """
+
+    def __init__(self, trie, in_play=(), read_history=()):
+        self.trie = trie
+        self.index = trie.index
+        self.in_play_mask = self.index.mask_of(in_play)
+        self.reset(read_history)
+
+    def reset(self, read_history=()):
+        # 配列のコピーだけで初期状態に戻す（読み順ごとにトライ木を作り直さない）
+        self.counts = self.trie.base_counts[:]
+        self.sums = self.trie.base_sums[:]
+        self.lengths = self.trie.base_lengths[:]
+        self.unread = self.index.all_mask
+        for k in read_history:
+            self.read(k)
+
+    def read_position(self, i):
+        bit = self.index.bits[i]
+        if not self.unread & bit:
+            raise ValueError(f"すでに読まれた札です: {self.index.kimariji[i]}")
+        self.unread ^= bit
+        counts = self.counts
+        sums = self.sums
+        path = self.trie.paths[i]
+        for node in path:
+            counts[node] -= 1
+            sums[node] -= i
+        # 読まれた札と音を共有する札のうち、残り1枚になった最も浅いノードの札だけ決まり字が縮む
+        for node in path:
+            if counts[node] == 1:
+                j = sums[node]
+                depth = self.trie.depths[node]
+                if depth < self.lengths[j]:
+                    self.lengths[j] = depth
+                    return j
+                return None
+        return None
+
+    def read(self, kimariji):
+        # 1枚読むごとに差分だけ更新し、決まり字が短くなった場札があればその札を返す
+        j = self.read_position(self.index.position[kimariji])
+        if j is None or not self.in_play_mask & self.index.bits[j]:
+            return None
+        return self.index.kimariji[j]
+
+    def current(self):
+        # 場に残っている札の {元の決まり字: 現在の決まり字}
+        remaining = self.in_play_mask & self.unread
+        return {k: k[:self.lengths[self.index.position[k]]] for k in self.index.names_of(remaining)}
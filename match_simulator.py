@@ -0,0 +1,128 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fuda_index import ZONES
+
+# 反応時間のモデル（ミリ秒）。決まり字の音が1つ増えるごとに PER_SOUND_MS だけ遅れる
+BASE_MS = 250.0
+PER_SOUND_MS = 120.0
+NOISE_MS = 60.0
+# 各段の札に手が届くまでの時間。自分は右利きで右下段が最も近く、
+# 相手は向かい合っているので自陣の上段（特に左上段）が相手に近い
+MY_REACH_MS = np.array([90.0, 60.0, 30.0, 80.0, 50.0, 20.0])
+OPP_REACH_MS = np.array([40.0, 70.0, 100.0, 50.0, 80.0, 110.0])
+# 決まり字を争う札（別れ札）が相手陣にあると、相手は自陣を守るため攻めが遅れる
+OPP_HESITATION_MS = 80.0
+CHUNK_GAMES = 2000
+# 試合を複数プロセスに分けるときのプロセス数の上限（placement_search.MAX_WORKERS と同じ考え方）
+MAX_WORKERS = 4
+
+
+class MatchSimulator:
+    """ランダムな試合を多数シミュレーションし、自陣の配置を数値で評価する。
+
+    1試合ごとに、残り75枚から相手の25枚、100枚すべての読み順をランダムに決める。
+    自陣の札が読まれたときの決まり字は、その時点でまだ読まれていない札との共通部分から決まる。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.lcp = np.array(index.common_prefix_lengths(), dtype=np.int8)
+
+    def _encode(self, placement):
+        cards = []
+        zones = []
+        for z, zone in enumerate(ZONES):
+            for k in placement.get(zone, []):
+                cards.append(self.index.position[k])
+                zones.append(z)
+        return np.array(cards), np.array(zones)
+
+    def _simulate_chunk(self, cards, zones, n_games, rng):
+        n_cards = len(self.index)
+        others = np.setdiff1d(np.arange(n_cards), cards)
+
+        # 読み順：キーが大きい札ほど後で読まれる
+        keys = rng.random((n_games, n_cards))
+        # 相手の25枚：自陣以外の75枚からランダムに選ぶ
+        opp_pick = np.argpartition(rng.random((n_games, len(others))), 25, axis=1)[:, :25]
+        opp_mask = np.zeros((n_games, n_cards), dtype=bool)
+        np.put_along_axis(opp_mask, others[opp_pick], True, axis=1)
+
+        # 自陣の札が読まれた時点で、まだ読まれていない札
+        later = keys[:, None, :] > keys[:, cards, None]
+        lcp = self.lcp[cards]
+        shared = np.where(later, lcp[None, :, :], 0)
+        longest = shared.max(axis=2)
+        sounds = longest + 1
+
+        # 決まり字を争う札が相手陣に残っているか
+        rival = later & opp_mask[:, None, :] & (lcp[None, :, :] == longest[:, :, None]) & (longest[:, :, None] > 0)
+        hesitation = rival.any(axis=2) * OPP_HESITATION_MS
+
+        reaction = BASE_MS + PER_SOUND_MS * sounds
+        my_time = reaction + MY_REACH_MS[zones] + rng.normal(0.0, NOISE_MS, sounds.shape)
+        opp_time = reaction + OPP_REACH_MS[zones] + hesitation + rng.normal(0.0, NOISE_MS, sounds.shape)
+        defended = my_time < opp_time
+        return defended, np.where(defended, my_time, 0.0), sounds
+
+    def _run(self, placement, games, seed):
+        cards, zones = self._encode(placement)
+        rng = np.random.default_rng(seed)
+        defended_sum = np.zeros(len(cards))
+        take_sum = np.zeros(len(cards))
+        sounds_sum = np.zeros(len(cards))
+        done = 0
+        while done < games:
+            n = min(CHUNK_GAMES, games - done)
+            defended, take_ms, sounds = self._simulate_chunk(cards, zones, n, rng)
+            defended_sum += defended.sum(axis=0)
+            take_sum += take_ms.sum(axis=0)
+            sounds_sum += sounds.sum(axis=0)
+            done += n
+        return {"games": games, "defended": defended_sum, "take_ms": take_sum, "sounds": sounds_sum}
+
+    def simulate(self, placement, games=10000, seed=None, workers=1):
+        """配置を評価し、防御率・平均の取り時間・段ごとの攻められやすさなどを返す。
+
+        workers > 1 なら試合を分けて複数プロセスで実行する（乱数の種はワーカーごとに SeedSequence から分ける）。
+        """
+        cards, zones = self._encode(placement)
+        workers = max(1, min(workers, MAX_WORKERS, games))
+        if workers > 1:
+            seeds = np.random.SeedSequence(seed).spawn(workers)
+            sizes = [games // workers + (w < games % workers) for w in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(self._run, [placement] * workers, sizes, seeds))
+        else:
+            parts = [self._run(placement, games, seed)]
+
+        defended = sum(p["defended"] for p in parts)
+        take_ms = sum(p["take_ms"] for p in parts)
+        sounds = sum(p["sounds"] for p in parts)
+
+        card_defend = defended / games
+        zone_defend = {}
+        for z, zone in enumerate(ZONES):
+            in_zone = zones == z
+            if in_zone.any():
+                zone_defend[zone] = float(card_defend[in_zone].mean())
+        return {
+            "games": games,
+            # 1試合で評価するのは自陣の札が読まれた回だけ
+            "reads": games * len(cards),
+            "defend_rate": float(card_defend.mean()),
+            "mean_take_ms": float(take_ms.sum() / max(defended.sum(), 1)),
+            "cards": {
+                self.index.kimariji[c]: {
+                    "zone": ZONES[z],
+                    "defend_rate": float(card_defend[i]),
+                    "mean_sounds": float(sounds[i] / games),
+                }
+                for i, (c, z) in enumerate(zip(cards, zones))
+            },
+            # 段ごとの攻められやすさ（相手に先に取られる割合）
+            "exposure": {zone: 1.0 - rate for zone, rate in zone_defend.items()},
+            "score": round(100.0 * float(card_defend.mean()), 1),
+        }
@@ -0,0 +1,69 @@
+import numpy as np
+
+from fuda_index import ZONES
+
+# 評価の重み。友札・同じ音の札は「自陣に残る札と別れる」ほど良く、
+# 「相手陣の札とそろう」ほど悪い。友札の項は共通部分の字数（重なりの深さ）を掛ける。
+# 決まり字が長い札ほど相手は守りにくい
+TOMO_WEIGHT = 1.0
+SOUND_WEIGHT = 0.1
+LENGTH_WEIGHT = 0.5
+
+
+class OkurifudaAdvisor:
+    """自陣と相手陣の配置から、送り札の候補（自陣の札すべて）を順位付けする。
+
+    札どうしの表（決まり字の共通字数・同じ音かどうか、100 × 100）は最初に一度だけ作り、
+    盤面が変わるたびに表と盤面ベクトルの積で全候補をまとめて評価する。
+    友札は、読まれていない札のうち決まり字の共通部分がいちばん長い札（現在の決まり字を決めている札）とする。
+    """
+
+    def __init__(self, index, lcp=None):
+        self.index = index
+        table = index.common_prefix_lengths() if lcp is None else lcp
+        self.lcp = np.asarray(table, dtype=np.int16)
+        self.sound = (self.lcp > 0).astype(np.int16)
+        self.lengths = np.array([len(k) for k in index.kimariji])
+
+    def _vector(self, names):
+        vec = np.zeros(len(self.index), dtype=bool)
+        for k in names:
+            i = self.index.position.get(k)
+            if i is not None:
+                vec[i] = True
+        return vec
+
+    def rank(self, own_placement, opp_placement, read_history=()):
+        """送り札の候補を評価の高い順に返す。読まれた札は両陣から除く。"""
+        unread = ~self._vector(read_history)
+        own = self._vector(k for z in ZONES for k in own_placement.get(z, [])) & unread
+        opp = self._vector(k for z in ZONES for k in opp_placement.get(z, [])) & unread
+
+        # 読まれていない札だけで決まる現在の決まり字の字数と、そのときの友札
+        shared = self.lcp * unread[None, :]
+        longest = shared.max(axis=1)
+        current = np.minimum(longest + 1, self.lengths)
+        tomo = ((shared == longest[:, None]) & (longest[:, None] > 0)).astype(np.int16)
+
+        # 友札のうち自陣に残る割合から相手陣にある割合を引き、重なりの深さを掛ける
+        tomo_balance = (tomo @ own - tomo @ opp) / np.maximum(tomo.sum(axis=1), 1)
+        score = (
+            TOMO_WEIGHT * longest * tomo_balance
+            + SOUND_WEIGHT * (self.sound @ own - self.sound @ opp)
+            + LENGTH_WEIGHT * current
+        )
+
+        zone_of = {k: z for z in ZONES for k in own_placement.get(z, [])}
+        ranking = []
+        for i in np.flatnonzero(own):
+            k = self.index.kimariji[i]
+            ranking.append({
+                "card": k,
+                "zone": zone_of[k],
+                "current_kimariji": k[:current[i]],
+                # 送ると別れ札になる自陣の友札と、相手陣でそろってしまう友札
+                "split": [self.index.kimariji[j] for j in np.flatnonzero(tomo[i] & own)],
+                "grouped": [self.index.kimariji[j] for j in np.flatnonzero(tomo[i] & opp)],
+                "score": float(score[i]),
+            })
+        return sorted(ranking, key=lambda r: -r["score"])
@@ -0,0 +1,62 @@
+import base64
+from functools import lru_cache
+
+from fuda_index import FudaIndex, ZONES, load_fuda_json
+
+CODE_VERSION = 1
+# 6つの段と、選んだがまだ置いていない札
+GROUPS = ZONES + ("unplaced",)
+
+
+class PlacementCodec:
+    """配置を「札の id（fuda.json）+ 段 + 段の中の順番」だけの短い文字列にする。
+
+    形式は 版(1バイト) + 7つのグループの枚数(各1バイト) + 札の id(各1バイト) を base64 にしたもの。
+    25枚の配置なら 33 バイト（44 文字）になる。段の中の並び順も含めて同じ配置からは
+    必ず同じ文字列になるので、文字列の比較だけで同じ配置かどうかを判定できる。
+    """
+
+    def __init__(self, index):
+        self.id_of = {f['kimariji']: f['id'] for f in index.cards}
+        self.kimariji_of = {f['id']: f['kimariji'] for f in index.cards}
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def default():
+        # 保存先など、アプリの外からも使う fuda.json の索引
+        return PlacementCodec(FudaIndex(load_fuda_json()))
+
+    def encode(self, placement, selected_fuda=()):
+        groups = [list(placement.get(zone, [])) for zone in ZONES]
+        placed = {k for group in groups for k in group}
+        groups.append([k for k in dict.fromkeys(selected_fuda) if k not in placed])
+
+        ids = []
+        for group in groups:
+            for k in group:
+                if k not in self.id_of:
+                    raise ValueError(f"不明な札です: {k}")
+                ids.append(self.id_of[k])
+        raw = bytes([CODE_VERSION] + [len(group) for group in groups] + ids)
+        return base64.b64encode(raw).decode("ascii")
+
+    def decode(self, code):
+        """(placement, selected_fuda) を返す。selected_fuda は段の順、最後に置いていない札の順に並ぶ。"""
+        raw = base64.b64decode(code)
+        if not raw or raw[0] != CODE_VERSION:
+            raise ValueError(f"対応していない配置コードです: {code}")
+        counts = raw[1:1 + len(GROUPS)]
+        ids = raw[1 + len(GROUPS):]
+        if len(counts) != len(GROUPS) or sum(counts) != len(ids):
+            raise ValueError(f"配置コードが壊れています: {code}")
+
+        placement = {}
+        selected_fuda = []
+        start = 0
+        for group, n in zip(GROUPS, counts):
+            names = [self.kimariji_of[i] for i in ids[start:start + n]]
+            if group in ZONES:
+                placement[group] = names
+            selected_fuda.extend(names)
+            start += n
+        return placement, selected_fuda
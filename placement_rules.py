@@ -0,0 +1,111 @@
+from fuda_index import ZONES
+
+# 診断ルール（streamlit_app.py のアドバイス表示と同じ順番）
+RULES = ("ichiji", "niji", "tomo", "scatter", "oyama")
+
+
+class PlacementRuleEngine:
+    """配置診断のルールをビット演算で判定するエンジン。
+
+    判定結果は {ルール名: 問題ありなら True} の辞書で返す。
+    """
+
+    def __init__(self, index, types=None):
+        self.index = index
+        self.types = list(index.types if types is None else types)
+        type_masks = {}
+        for i, t in enumerate(self.types):
+            type_masks[t] = type_masks.get(t, 0) | index.bits[i]
+        self.ichiji_mask = type_masks.get(1, 0)
+        self.niji_mask = type_masks.get(2, 0)
+        self.oyama_mask = type_masks.get(6, 0)
+        self.tomo_masks = index.tomo_masks
+
+    def with_kimariji(self, current_kimariji):
+        # 試合中に変化した決まり字 {元の決まり字: 現在の決まり字} の字数で判定するエンジン
+        types = self.types[:]
+        for k, current in current_kimariji.items():
+            types[self.index.position[k]] = len(current)
+        return PlacementRuleEngine(self.index, types)
+
+    def encode(self, placement):
+        # 各段のビット集合と、下段の端（内側・外側）にある札のビット集合
+        zone_masks = tuple(self.index.mask_of(placement.get(z, [])) for z in ZONES)
+        edge_mask = 0
+        for z in ("l_low", "r_low"):
+            row = placement.get(z, [])
+            if row:
+                edge_mask |= self.index.mask_of([row[0], row[-1]])
+        return zone_masks, edge_mask
+
+    def evaluate_encoded(self, encoded):
+        (l_top, l_mid, l_low, r_top, r_mid, r_low), edge_mask = encoded
+        tiers = (l_top, l_mid, l_low, r_top, r_mid, r_low)
+        low = l_low | r_low
+        mid_low = l_mid | r_mid | low
+        left = l_top | l_mid | l_low
+        right = r_top | r_mid | r_low
+        placed = left | right
+
+        # 1. 決まり字が1字の札はすべて下段か
+        ichiji = bool(placed & self.ichiji_mask & ~low)
+
+        # 2. 決まり字が2字の札が中段以下に3分の2より多くあるか
+        niji = placed & self.niji_mask
+        niji_total = niji.bit_count()
+        niji_issue = niji_total > 0 and 3 * (niji & mid_low).bit_count() <= 2 * niji_total
+
+        # 3. 同じ段に同じ音の札が2枚以上ないか
+        tomo = any((tier & m).bit_count() > 1 for m in self.tomo_masks for tier in tiers)
+
+        # 4. 同じ側に同じ音の札が3枚以上固まっていないか
+        scatter = any((left & m).bit_count() >= 3 or (right & m).bit_count() >= 3 for m in self.tomo_masks)
+
+        # 5. 大山札が下段の端にあるか
+        oyama = bool(placed & self.oyama_mask & ~edge_mask)
+
+        return {"ichiji": ichiji, "niji": niji_issue, "tomo": tomo, "scatter": scatter, "oyama": oyama}
+
+    def violations_encoded(self, encoded):
+        # 各ルールの違反の度合い（0 ならそのルールは問題なし）。配置の自動探索の評価に使う
+        (l_top, l_mid, l_low, r_top, r_mid, r_low), edge_mask = encoded
+        tiers = (l_top, l_mid, l_low, r_top, r_mid, r_low)
+        low = l_low | r_low
+        left = l_top | l_mid | l_low
+        right = r_top | r_mid | r_low
+        placed = left | right
+
+        niji = placed & self.niji_mask
+        niji_total = niji.bit_count()
+        niji_short = 0
+        if niji_total:
+            niji_short = max(0, (2 * niji_total) // 3 + 1 - (niji & (l_mid | r_mid | low)).bit_count())
+
+        tomo = 0
+        scatter = 0
+        for m in self.tomo_masks:
+            for tier in tiers:
+                tomo += max(0, (tier & m).bit_count() - 1)
+            scatter += max(0, (left & m).bit_count() - 2) + max(0, (right & m).bit_count() - 2)
+
+        return {
+            "ichiji": (placed & self.ichiji_mask & ~low).bit_count(),
+            "niji": niji_short,
+            "tomo": tomo,
+            "scatter": scatter,
+            "oyama": (placed & self.oyama_mask & ~edge_mask).bit_count(),
+        }
+
+    def evaluate(self, placement):
+        return self.evaluate_encoded(self.encode(placement))
+
+    def count_issues(self, placements):
+        # 保存済みデッキの再採点：ルールごとの「問題あり」件数と、判定した配置の件数
+        counts = dict.fromkeys(RULES, 0)
+        total = 0
+        for placement in placements:
+            result = self.evaluate(placement)
+            for rule in RULES:
+                counts[rule] += result[rule]
+            total += 1
+        return counts, total
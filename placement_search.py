@@ -0,0 +1,130 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from fuda_index import ZONES, FudaIndex, load_fuda_json
+from placement_rules import PlacementRuleEngine
+
+# ルールごとの重み（診断で指摘される項目ほど重くする）
+RULE_WEIGHTS = {"ichiji": 3.0, "niji": 2.0, "tomo": 2.0, "scatter": 1.0, "oyama": 2.0}
+# 左右の枚数差と段ごとの枚数の偏りは、同点の配置を並べるための小さな重み
+BALANCE_WEIGHT = 0.05
+MAX_PER_ROW = 8
+# 1回の提案で使うプロセス数の上限（共有のサーバーで CPU を使い切らないように）
+MAX_WORKERS = 4
+
+
+@lru_cache(maxsize=1)
+def _default_engine():
+    # ワーカープロセスでは fuda.json から一度だけ作る
+    return PlacementRuleEngine(FudaIndex(load_fuda_json()))
+
+
+def layout_cost(engine, rows):
+    placement = dict(zip(ZONES, rows))
+    violations = engine.violations_encoded(engine.encode(placement))
+    cost = sum(RULE_WEIGHTS[rule] * n for rule, n in violations.items())
+    sizes = [len(row) for row in rows]
+    balance = abs(sum(sizes[:3]) - sum(sizes[3:])) + (max(sizes) - min(sizes))
+    return cost + BALANCE_WEIGHT * balance
+
+
+def layout_key(rows):
+    # 段ごとの札の集合が同じなら同じ配置とみなす（下段は端の札も区別する）
+    key = [frozenset(row) for row in rows]
+    for z in (2, 5):
+        row = rows[z]
+        key.append(frozenset((row[0], row[-1])) if row else frozenset())
+    return tuple(key)
+
+
+def _random_layout(cards, rng):
+    # 6つの段に順に配るので、1段の枚数は MAX_PER_ROW を超えない
+    cards = cards[:]
+    rng.shuffle(cards)
+    rows = [[] for _ in ZONES]
+    for i, card in enumerate(cards):
+        rows[i % len(ZONES)].append(card)
+    return rows
+
+
+def _neighbor(rows, rng, max_per_row):
+    rows = [row[:] for row in rows]
+    src = rng.randrange(len(rows))
+    while not rows[src]:
+        src = rng.randrange(len(rows))
+    i = rng.randrange(len(rows[src]))
+    dst = rng.randrange(len(rows))
+    if rng.random() < 0.5 and len(rows[dst]) < max_per_row and dst != src:
+        # 1枚を別の段の好きな位置へ移す
+        card = rows[src].pop(i)
+        rows[dst].insert(rng.randint(0, len(rows[dst])), card)
+    elif rows[dst]:
+        # 2枚を入れ替える（同じ段なら並び順だけが変わる）
+        j = rng.randrange(len(rows[dst]))
+        rows[src][i], rows[dst][j] = rows[dst][j], rows[src][i]
+    return rows
+
+
+def anneal(cards, time_budget=2.0, top_n=5, seed=None, engine=None, max_per_row=MAX_PER_ROW):
+    """焼きなまし法で配置を探し、評価の良い順に (コスト, 段ごとの札) を返す。"""
+    engine = engine or _default_engine()
+    rng = random.Random(seed)
+    current = _random_layout(list(cards), rng)
+    current_cost = layout_cost(engine, current)
+    best = {layout_key(current): (current_cost, current)}
+
+    start = time.perf_counter()
+    t_high, t_low = 2.0, 0.02
+    temperature = t_high
+    step = 0
+    while True:
+        if step % 200 == 0:
+            elapsed = time.perf_counter() - start
+            if elapsed >= time_budget:
+                break
+            # 経過時間に合わせて温度を下げる
+            temperature = t_high * (t_low / t_high) ** (elapsed / time_budget)
+        step += 1
+
+        candidate = _neighbor(current, rng, max_per_row)
+        cost = layout_cost(engine, candidate)
+        if cost <= current_cost or rng.random() < math.exp((current_cost - cost) / temperature):
+            current, current_cost = candidate, cost
+            key = layout_key(current)
+            worst = max(c for c, _ in best.values())
+            if key not in best and (len(best) < top_n or cost < worst):
+                best[key] = (cost, current)
+                if len(best) > top_n:
+                    del best[max(best, key=lambda k: best[k][0])]
+
+    return sorted(best.values(), key=lambda x: x[0])
+
+
+def _anneal_worker(args):
+    cards, time_budget, top_n, seed, max_per_row = args
+    return anneal(cards, time_budget, top_n, seed, max_per_row=max_per_row)
+
+
+def suggest_placements(cards, time_budget=3.0, top_n=5, workers=None, seed=None, max_per_row=MAX_PER_ROW):
+    """複数プロセスで探索し、重複のない上位 top_n 件を {位置: [決まり字]} の形で返す。"""
+    workers = max(1, min(workers or os.cpu_count() or 1, MAX_WORKERS))
+    base_seed = random.Random(seed).randrange(1 << 30)
+    jobs = [(list(cards), time_budget, top_n, base_seed + w, max_per_row) for w in range(workers)]
+    if workers == 1:
+        results = [_anneal_worker(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_anneal_worker, jobs))
+
+    merged = {}
+    for result in results:
+        for cost, rows in result:
+            key = layout_key(rows)
+            if key not in merged or cost < merged[key][0]:
+                merged[key] = (cost, rows)
+    ranked = sorted(merged.values(), key=lambda x: x[0])[:top_n]
+    return [(cost, dict(zip(ZONES, rows))) for cost, rows in ranked]
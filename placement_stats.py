@@ -0,0 +1,55 @@
+import numpy as np
+
+from fuda_index import ZONES
+
+
+class PlacementCounts:
+    """札 × 位置（100 × 6）の配置回数を保持する集計行列。
+
+    保存済みデッキの数に関係なく一定の大きさなので、
+    ヒートマップや札ごとの内訳はこの行列からベクトル演算で作る。
+    """
+
+    def __init__(self, index, counts=None):
+        self.index = index
+        if counts is None:
+            counts = np.zeros((len(index), len(ZONES)), dtype=np.int64)
+        self.counts = counts
+
+    @classmethod
+    def from_rows(cls, index, rows):
+        # 集計テーブルの行 {"fuda": 決まり字, "position": 位置, "count": 回数} から作る
+        agg = cls(index)
+        zone_pos = {z: j for j, z in enumerate(ZONES)}
+        for row in rows:
+            i = index.position.get(row['fuda'])
+            j = zone_pos.get(row['position'])
+            if i is not None and j is not None:
+                agg.counts[i, j] += row['count']
+        return agg
+
+    def add(self, placement, n=1):
+        # 保存された配置1件分を差分で反映する
+        for j, zone in enumerate(ZONES):
+            rows = [self.index.position[k] for k in placement.get(zone, []) if k in self.index.position]
+            if rows:
+                np.add.at(self.counts[:, j], rows, n)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def zone_totals(self):
+        return self.counts.sum(axis=0)
+
+    def card_counts(self, kimariji):
+        return self.counts[self.index.position[kimariji]]
+
+    def placed_kimariji(self):
+        # 一度でも配置されたことのある札（決まり字順）
+        used = np.flatnonzero(self.counts.sum(axis=1))
+        return [self.index.kimariji[i] for i in used]
+
+    @staticmethod
+    def grid(zone_vector):
+        # ZONES 順の6要素を「段（上・中・下）× 左右」の 3 × 2 に並べ替える
+        return np.asarray(zone_vector).reshape(2, 3).T
@@ -0,0 +1,111 @@
+import datetime
+from collections import Counter
+
+from fuda_index import ZONES
+
+# 1日ごとの集計値（karuta_placement_rollups の metric 列）
+METRICS = ("decks",) + ZONES + ("ichiji", "ichiji_low", "tomo_pairs", "tomo_split")
+PERIODS = ("day", "week", "month")
+
+
+def deck_metrics(placement):
+    """1つの配置の集計値。
+
+    決まり字の字数は決まり字の長さ、友札は決まり字の1字目が同じ札として数える
+    （sql/karuta_placement_rollups.sql のトリガーと同じ定義）。
+    """
+    metrics = Counter(decks=1)
+    sides = {}
+    for z, zone in enumerate(ZONES):
+        row = placement.get(zone, [])
+        metrics[zone] += len(row)
+        for k in row:
+            if len(k) == 1:
+                metrics["ichiji"] += 1
+                if zone in ("l_low", "r_low"):
+                    metrics["ichiji_low"] += 1
+            left, right = sides.get(k[0], (0, 0))
+            sides[k[0]] = (left + 1, right) if z < 3 else (left, right + 1)
+
+    # 友札の組の数と、そのうち左右に分かれている組の数
+    for left, right in sides.values():
+        n = left + right
+        metrics["tomo_pairs"] += n * (n - 1) // 2
+        metrics["tomo_split"] += left * right
+    return metrics
+
+
+def day_of(created_at):
+    # 作成日時（ISO 形式の文字列）の日付部分。保存一覧の表示と同じく先頭10文字を使う
+    return str(created_at)[:10]
+
+
+def bucket_of(day, period):
+    date = datetime.date.fromisoformat(day)
+    if period == "week":
+        date -= datetime.timedelta(days=date.weekday())
+    elif period == "month":
+        date = date.replace(day=1)
+    return date.isoformat()
+
+
+class PlacementTrends:
+    """日ごとの集計（ロールアップ）から、配置の傾向の推移を計算する。
+
+    集計は {日付: Counter(集計値)} で持ち、週・月単位にはここでまとめ直す。
+    """
+
+    def __init__(self, days=None):
+        self.days = days or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        # 集計テーブルの行 {"day", "metric", "value"} から作る（METRICS にない集計値は読み飛ばす）
+        days = {}
+        for row in rows:
+            if row['metric'] not in METRICS:
+                continue
+            days.setdefault(day_of(row['day']), Counter())[row['metric']] += row['value']
+        return cls(days)
+
+    @classmethod
+    def from_decks(cls, decks):
+        # 集計テーブルがない保存先向け。保存済みの配置から数え直す
+        trends = cls()
+        for deck in decks:
+            trends.add(deck['placement'], deck['created_at'])
+        return trends
+
+    def add(self, placement, created_at):
+        self.days.setdefault(day_of(created_at), Counter()).update(deck_metrics(placement))
+
+    def to_rows(self):
+        return [
+            {"day": day, "metric": metric, "value": value}
+            for day, metrics in sorted(self.days.items())
+            for metric, value in metrics.items() if value
+        ]
+
+    def series(self, period="day"):
+        """期間ごとの配置数と傾向の割合を古い順に返す。"""
+        buckets = {}
+        for day, metrics in self.days.items():
+            buckets.setdefault(bucket_of(day, period), Counter()).update(metrics)
+
+        result = []
+        for start, m in sorted(buckets.items()):
+            if not m["decks"]:
+                continue
+            placed = sum(m[zone] for zone in ZONES)
+            point = {
+                "period": start,
+                "decks": m["decks"],
+                # 1字決まりの札のうち下段に置いた割合
+                "ichiji_low_ratio": m["ichiji_low"] / m["ichiji"] if m["ichiji"] else None,
+                # 友札の組のうち左右に分けて置いた割合
+                "tomo_split_ratio": m["tomo_split"] / m["tomo_pairs"] if m["tomo_pairs"] else None,
+            }
+            for zone in ZONES:
+                point[zone] = m[zone] / placed if placed else None
+            result.append(point)
+        return result
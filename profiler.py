@@ -0,0 +1,140 @@
+import csv
+import functools
+import io
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class RerunProfiler:
+    """スクリプトの再実行ごとに、セクションの処理時間と保存先の呼び出しを記録する。
+
+    記録は直近 history_size 回分だけ保持する。無効のときは何も記録しない。
+    """
+
+    def __init__(self, enabled=False, history_size=50):
+        self.enabled = enabled
+        self.history = deque(maxlen=history_size)
+        self.current = None
+        self.in_full_run = False
+        self.depth = 0
+        self.run_count = 0
+
+    def _new_run(self, scope):
+        self.run_count += 1
+        run = {
+            "run": self.run_count,
+            "scope": scope,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "sections": {},
+            "calls": {},
+        }
+        self.history.append(run)
+        return run
+
+    def begin_run(self):
+        # スクリプト全体の再実行の最初に呼ぶ
+        if self.enabled:
+            self.current = self._new_run("app")
+            self.in_full_run = True
+
+    def end_run(self):
+        self.in_full_run = False
+
+    def _target_run(self, scope):
+        # フラグメントだけの再実行はそれぞれ1回分の記録として残す
+        if (self.in_full_run or self.depth > 0) and self.current is not None:
+            return self.current
+        self.current = self._new_run(scope)
+        return self.current
+
+    @contextmanager
+    def section(self, name):
+        if not self.enabled:
+            yield
+            return
+        run = self._target_run(f"fragment:{name}")
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # st.rerun() などで途中で抜けた場合も時間を残す
+            elapsed = (time.perf_counter() - start) * 1000
+            run["sections"][name] = run["sections"].get(name, 0.0) + elapsed
+            self.depth -= 1
+
+    def track(self, name):
+        # 関数全体を1つのセクションとして計測するデコレータ（フラグメント関数に使う）
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.section(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_call(self, name, elapsed_ms):
+        if not self.enabled:
+            return
+        run = self._target_run("backend")
+        count, total = run["calls"].get(name, (0, 0.0))
+        run["calls"][name] = (count + 1, total + elapsed_ms)
+
+    def to_records(self):
+        records = []
+        for run in self.history:
+            for name, ms in run["sections"].items():
+                records.append({"run": run["run"], "scope": run["scope"], "started_at": run["started_at"],
+                                "kind": "section", "name": name, "count": 1, "ms": round(ms, 2)})
+            for name, (count, ms) in run["calls"].items():
+                records.append({"run": run["run"], "scope": run["scope"], "started_at": run["started_at"],
+                                "kind": "backend", "name": name, "count": count, "ms": round(ms, 2)})
+        return records
+
+    def to_json(self):
+        return json.dumps(self.to_records(), ensure_ascii=False, indent=2)
+
+    def to_csv(self):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=["run", "scope", "started_at", "kind", "name", "count", "ms"])
+        writer.writeheader()
+        writer.writerows(self.to_records())
+        return buf.getvalue()
+
+
+class ProfiledStorage:
+    """保存先（DeckStorage）の呼び出し回数と時間をプロファイラに記録するラッパー。"""
+
+    def __init__(self, storage, profiler):
+        self._storage = storage
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not callable(attr):
+            return attr
+        label = f"{self._storage.name}.{name}"
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self._profiler.record_call(label, (time.perf_counter() - start) * 1000)
+                raise
+            if hasattr(result, "__next__"):
+                return self._timed_iter(label, result, start)
+            self._profiler.record_call(label, (time.perf_counter() - start) * 1000)
+            return result
+        return wrapper
+
+    def _timed_iter(self, label, iterator, start):
+        # ページ単位で読み込むジェネレータは、読み終わるまでの時間をまとめて記録する
+        try:
+            yield from iterator
+        finally:
+            self._profiler.record_call(label, (time.perf_counter() - start) * 1000)
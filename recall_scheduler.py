@@ -0,0 +1,145 @@
+import atexit
+import datetime
+import queue
+import random
+import threading
+import time
+
+# 正解を続けるごとに次の出題までの間隔を延ばす（秒）。間違えたら最初に戻る
+INTERVALS = (0, 60, 5 * 60, 30 * 60, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600, 21 * 24 * 3600)
+DRILL_SIZE = 5
+
+
+def now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def timestamp_of(iso):
+    value = datetime.datetime.fromisoformat(str(iso))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+class RecallScheduler:
+    """札 × 段ごとの暗記の記録から、次に出題する札を選ぶ（間隔反復）。
+
+    回答イベント {"card", "zone", "answer", "correct", "answered_at"} を順に反映し、
+    札 × 段ごとに段階（正解が続いた回数）・次の出題時刻・正解数・回答数を持つ。
+    """
+
+    def __init__(self, events=()):
+        self.state = {}
+        for event in events:
+            self.record(event)
+
+    def record(self, event):
+        key = (event['card'], event['zone'])
+        s = self.state.setdefault(key, {"box": 0, "due": 0.0, "correct": 0, "attempts": 0})
+        answered_at = timestamp_of(event['answered_at'])
+        s["attempts"] += 1
+        if event['correct']:
+            s["correct"] += 1
+            s["box"] = min(s["box"] + 1, len(INTERVALS) - 1)
+        else:
+            s["box"] = 0
+        s["due"] = answered_at + INTERVALS[s["box"]]
+
+    def priority(self, card, zone, now):
+        # 小さいほど先に出題する：出題時刻を過ぎたもの → 段階が低いもの → 正答率が低いもの → 出題時刻が早いもの
+        s = self.state.get((card, zone))
+        if s is None:
+            return (False, 0, 0.5, 0.0)
+        return (s["due"] > now, s["box"], s["correct"] / s["attempts"], s["due"])
+
+    def drill(self, placement, size=DRILL_SIZE, now=None, rng=random):
+        """配置の中から、苦手な順に (札, 段) を size 個選ぶ。同じ優先度（まだ出題していない札など）はランダムに選ぶ。"""
+        now = time.time() if now is None else now
+        pairs = [(card, zone) for zone, cards in placement.items() for card in cards]
+        return sorted(pairs, key=lambda p: self.priority(p[0], p[1], now) + (rng.random(),))[:size]
+
+    def weakest(self, placement, n=5):
+        # 回答したことがある札 × 段を正答率の低い順に
+        rows = []
+        for zone, cards in placement.items():
+            for card in cards:
+                s = self.state.get((card, zone))
+                if s and s["attempts"]:
+                    rows.append({
+                        "card": card, "zone": zone,
+                        "accuracy": s["correct"] / s["attempts"], "attempts": s["attempts"]
+                    })
+        return sorted(rows, key=lambda r: (r["accuracy"], -r["attempts"]))[:n]
+
+
+class RecallEventWriter:
+    """回答イベントをためておき、別スレッドでまとめて保存先に書き込む（書き込みを待たずに次の問題へ進める）。
+
+    batch_size 件たまるか flush_interval 秒たつと書き込む。失敗した分は間隔を延ばしながらやり直し、
+    max_pending 件を超えたら古いものから捨てる。
+    """
+
+    def __init__(self, storage, batch_size=50, flush_interval=5.0, max_pending=10000):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue = queue.Queue()
+        self.pending = []
+        self.written = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="recall-event-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def put(self, event):
+        self.queue.put(event)
+
+    def _drain(self, timeout):
+        # 最初の1件は待ち、そのあとはたまっている分だけ取る。pending は atexit の flush と共有するのでロックを取る
+        try:
+            event = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        with self.lock:
+            self.pending.append(event)
+            while len(self.pending) < self.batch_size:
+                try:
+                    self.pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            self._drain(max(deadline - time.monotonic(), 0.01))
+            with self.lock:
+                full = len(self.pending) >= self.batch_size and not self.consecutive_failures
+            if full or time.monotonic() >= deadline:
+                self.flush()
+                deadline = time.monotonic() + self.flush_interval * 2 ** min(self.consecutive_failures, 4)
+
+    def flush(self):
+        with self.lock:
+            while True:
+                try:
+                    self.pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self.pending:
+                return
+            batch = self.pending[:]
+            try:
+                self.storage.insert_recall_events(batch)
+            except Exception as e:
+                self.failures += 1
+                self.consecutive_failures += 1
+                self.last_error = str(e)
+                del self.pending[:max(0, len(self.pending) - self.max_pending)]
+                return
+            del self.pending[:len(batch)]
+            self.written += len(batch)
+            self.consecutive_failures = 0
@@ -0,0 +1,256 @@
+-- 配置コード（placement_codec.py）への移行
+-- 配置を JSON の2列（selected_fuda, placement）ではなく、札の id・段・順番だけの短い文字列
+-- placement_code で持つ。形式は 版(1バイト) + 7グループ（6つの段と置いていない札）の枚数 + 札の id を base64 にしたもの。
+--
+-- 実行の順番：
+--   1. このファイルを実行する（列の追加・既存行の変換・集計トリガーの更新）
+--   2. アプリを更新する（以後の保存は placement_code だけを書き込む）
+--   3. 必要ならファイル末尾のコメントを外して JSON の2列を空にし、行を小さくする
+-- 集計（karuta_fuda_position_counts.sql / karuta_placement_rollups.sql）はこのファイルの関数を使うので、
+-- 初めて設定するときはこのファイルの後に実行する。集計のファイルを後から実行し直しても、トリガーは配置コードに対応したまま
+
+-- 札の id と決まり字の対応（fuda.json と同じ）
+create table if not exists karuta_fuda (
+    id smallint primary key,
+    kimariji text not null unique
+);
+insert into karuta_fuda (id, kimariji) values
+    (1, 'あきの'),
+    (2, 'はるす'),
+    (3, 'あし'),
+    (4, 'たご'),
+    (5, 'おく'),
+    (6, 'かさ'),
+    (7, 'あまの'),
+    (8, 'わがい'),
+    (9, 'はなの'),
+    (10, 'これ'),
+    (11, 'わたのはらや'),
+    (12, 'あまつ'),
+    (13, 'つく'),
+    (14, 'みち'),
+    (15, 'きみがためは'),
+    (16, 'たち'),
+    (17, 'ちは'),
+    (18, 'す'),
+    (19, 'なにはが'),
+    (20, 'わび'),
+    (21, 'いまこ'),
+    (22, 'ふ'),
+    (23, 'つき'),
+    (24, 'この'),
+    (25, 'なにし'),
+    (26, 'おぐ'),
+    (27, 'みかの'),
+    (28, 'やまざ'),
+    (29, 'こころあ'),
+    (30, 'ありあ'),
+    (31, 'あさぼらけあ'),
+    (32, 'やまが'),
+    (33, 'ひさ'),
+    (34, 'たれ'),
+    (35, 'ひとは'),
+    (36, 'なつ'),
+    (37, 'しら'),
+    (38, 'わすら'),
+    (39, 'あさじ'),
+    (40, 'しの'),
+    (41, 'こい'),
+    (42, 'ちぎりき'),
+    (43, 'あい'),
+    (44, 'おおこ'),
+    (45, 'あわれ'),
+    (46, 'ゆら'),
+    (47, 'やえ'),
+    (48, 'かぜを'),
+    (49, 'みかき'),
+    (50, 'きみがためお'),
+    (51, 'かく'),
+    (52, 'あけ'),
+    (53, 'なげき'),
+    (54, 'わすれ'),
+    (55, 'たき'),
+    (56, 'あらざ'),
+    (57, 'め'),
+    (58, 'ありま'),
+    (59, 'やす'),
+    (60, 'おおえ'),
+    (61, 'いに'),
+    (62, 'よを'),
+    (63, 'いまは'),
+    (64, 'あさぼらけう'),
+    (65, 'うら'),
+    (66, 'もろ'),
+    (67, 'はるの'),
+    (68, 'こころに'),
+    (69, 'あらし'),
+    (70, 'さ'),
+    (71, 'ゆう'),
+    (72, 'おと'),
+    (73, 'たか'),
+    (74, 'うか'),
+    (75, 'ちぎりお'),
+    (76, 'わたのはらこ'),
+    (77, 'せ'),
+    (78, 'あわじ'),
+    (79, 'あきか'),
+    (80, 'ながか'),
+    (81, 'ほ'),
+    (82, 'おも'),
+    (83, 'よのなかよ'),
+    (84, 'ながら'),
+    (85, 'よも'),
+    (86, 'なげけ'),
+    (87, 'む'),
+    (88, 'なにはえ'),
+    (89, 'たま'),
+    (90, 'みせ'),
+    (91, 'きり'),
+    (92, 'わがそ'),
+    (93, 'よのなかは'),
+    (94, 'みよ'),
+    (95, 'おおけ'),
+    (96, 'はなさ'),
+    (97, 'こぬ'),
+    (98, 'かぜそ'),
+    (99, 'ひとも'),
+    (100, 'もも')
+on conflict (id) do nothing;
+
+alter table karuta_decks add column if not exists placement_code text;
+alter table karuta_decks alter column selected_fuda drop not null;
+alter table karuta_decks alter column placement drop not null;
+create index if not exists karuta_decks_placement_code on karuta_decks (placement_code);
+
+create or replace function karuta_encode_placement(placement jsonb, selected_fuda jsonb)
+returns text
+language plpgsql stable as $$
+declare
+    zones text[] := array['l_top', 'l_mid', 'l_low', 'r_top', 'r_mid', 'r_low'];
+    counts int[] := array[]::int[];
+    ids int[] := array[]::int[];
+    group_ids int[];
+    zone text;
+    code bytea;
+    i int;
+begin
+    foreach zone in array zones loop
+        select coalesce(array_agg(f.id order by e.ord), array[]::int[]) into group_ids
+        from jsonb_array_elements_text(coalesce(placement -> zone, '[]'::jsonb)) with ordinality as e(k, ord)
+        join karuta_fuda f on f.kimariji = e.k;
+        counts := counts || cardinality(group_ids);
+        ids := ids || group_ids;
+    end loop;
+    -- 選んだがまだ置いていない札
+    select coalesce(array_agg(f.id order by e.ord), array[]::int[]) into group_ids
+    from (
+        select k, min(ord) as ord
+        from jsonb_array_elements_text(coalesce(selected_fuda, '[]'::jsonb)) with ordinality as s(k, ord)
+        group by k
+    ) e
+    join karuta_fuda f on f.kimariji = e.k
+    where not (f.id = any(ids));
+    counts := counts || cardinality(group_ids);
+    ids := ids || group_ids;
+
+    code := decode(repeat('00', 1 + cardinality(counts) + cardinality(ids)), 'hex');
+    code := set_byte(code, 0, 1);
+    for i in 1 .. cardinality(counts) loop
+        code := set_byte(code, i, counts[i]);
+    end loop;
+    for i in 1 .. cardinality(ids) loop
+        code := set_byte(code, cardinality(counts) + i, ids[i]);
+    end loop;
+    return replace(encode(code, 'base64'), E'\n', '');
+end;
+$$;
+
+create or replace function karuta_decode_placement(code text)
+returns jsonb
+language plpgsql stable as $$
+declare
+    zones text[] := array['l_top', 'l_mid', 'l_low', 'r_top', 'r_mid', 'r_low'];
+    raw bytea := decode(code, 'base64');
+    result jsonb := '{}'::jsonb;
+    pos int := 8;
+    n int;
+    z int;
+begin
+    for z in 1 .. 6 loop
+        n := get_byte(raw, z);
+        result := result || jsonb_build_object(zones[z], coalesce((
+            select jsonb_agg(f.kimariji order by g.i)
+            from generate_series(pos, pos + n - 1) as g(i)
+            join karuta_fuda f on f.id = get_byte(raw, g.i)
+        ), '[]'::jsonb));
+        pos := pos + n;
+    end loop;
+    return result;
+end;
+$$;
+
+-- 既存の行を変換する
+update karuta_decks
+set placement_code = karuta_encode_placement(placement::jsonb, selected_fuda::jsonb)
+where placement_code is null and placement is not null;
+
+-- 集計トリガー（karuta_fuda_position_counts.sql / karuta_placement_rollups.sql）が
+-- placement_code だけの行も数えられるようにする
+create or replace function karuta_deck_placement(placement jsonb, placement_code text)
+returns jsonb
+language sql stable as $$
+    select coalesce(placement, karuta_decode_placement(placement_code))
+$$;
+
+create or replace function karuta_apply_position_counts() returns trigger
+language plpgsql as $$
+begin
+    if tg_op = 'INSERT' then
+        insert into karuta_fuda_position_counts (fuda, position, count)
+        select f.fuda, p.key, count(*)
+        from jsonb_each(karuta_deck_placement(new.placement::jsonb, new.placement_code)) as p,
+             jsonb_array_elements_text(p.value) as f(fuda)
+        group by f.fuda, p.key
+        on conflict (fuda, position)
+        do update set count = karuta_fuda_position_counts.count + excluded.count;
+        return new;
+    else
+        update karuta_fuda_position_counts c
+        set count = c.count - d.n
+        from (
+            select f.fuda, p.key as position, count(*) as n
+            from jsonb_each(karuta_deck_placement(old.placement::jsonb, old.placement_code)) as p,
+                 jsonb_array_elements_text(p.value) as f(fuda)
+            group by f.fuda, p.key
+        ) d
+        where c.fuda = d.fuda and c.position = d.position;
+        return old;
+    end if;
+end;
+$$;
+
+create or replace function karuta_apply_placement_rollups() returns trigger
+language plpgsql as $$
+declare
+    d karuta_decks%rowtype;
+    sign bigint;
+begin
+    if tg_op = 'INSERT' then
+        d := new;
+        sign := 1;
+    else
+        d := old;
+        sign := -1;
+    end if;
+    insert into karuta_placement_rollups (day, metric, value)
+    select (d.created_at at time zone 'utc')::date, m.metric, sign * m.value
+    from karuta_placement_metrics(karuta_deck_placement(d.placement::jsonb, d.placement_code)) as m
+    where m.value <> 0
+    on conflict (day, metric)
+    do update set value = karuta_placement_rollups.value + excluded.value;
+    return d;
+end;
+$$;
+
+-- 3. アプリの更新後、JSON の2列を空にして行を小さくする（元に戻すには karuta_decode_placement を使う）
+-- update karuta_decks set selected_fuda = null, placement = null where placement_code is not null;
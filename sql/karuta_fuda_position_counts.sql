@@ -0,0 +1,53 @@
+-- 札 × 位置ごとの配置回数の集計テーブル
+-- karuta_decks への保存・削除のたびにトリガーで差分更新する。
+-- 分析画面はこのテーブル（最大 100 × 6 行）だけを読み込む。
+-- 配置は karuta_deck_placement（JSON の列、なければ placement_code）から読むので、
+-- 先に karuta_decks_placement_code.sql を実行しておく。
+
+create table if not exists karuta_fuda_position_counts (
+    fuda text not null,
+    position text not null,
+    count bigint not null default 0,
+    primary key (fuda, position)
+);
+
+create or replace function karuta_apply_position_counts() returns trigger
+language plpgsql as $$
+begin
+    if tg_op = 'INSERT' then
+        insert into karuta_fuda_position_counts (fuda, position, count)
+        select f.fuda, p.key, count(*)
+        from jsonb_each(karuta_deck_placement(new.placement::jsonb, new.placement_code)) as p,
+             jsonb_array_elements_text(p.value) as f(fuda)
+        group by f.fuda, p.key
+        on conflict (fuda, position)
+        do update set count = karuta_fuda_position_counts.count + excluded.count;
+        return new;
+    else
+        update karuta_fuda_position_counts c
+        set count = c.count - d.n
+        from (
+            select f.fuda, p.key as position, count(*) as n
+            from jsonb_each(karuta_deck_placement(old.placement::jsonb, old.placement_code)) as p,
+                 jsonb_array_elements_text(p.value) as f(fuda)
+            group by f.fuda, p.key
+        ) d
+        where c.fuda = d.fuda and c.position = d.position;
+        return old;
+    end if;
+end;
+$$;
+
+drop trigger if exists karuta_decks_position_counts on karuta_decks;
+create trigger karuta_decks_position_counts
+after insert or delete on karuta_decks
+for each row execute function karuta_apply_position_counts();
+
+-- 既存データからの初期集計（トリガー作成後に一度だけ実行）
+truncate karuta_fuda_position_counts;
+insert into karuta_fuda_position_counts (fuda, position, count)
+select f.fuda, p.key, count(*)
+from karuta_decks d,
+     jsonb_each(karuta_deck_placement(d.placement::jsonb, d.placement_code)) as p,
+     jsonb_array_elements_text(p.value) as f(fuda)
+group by f.fuda, p.key;
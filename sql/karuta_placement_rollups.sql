@@ -0,0 +1,81 @@
+-- 日ごとの配置傾向の集計テーブル（経時変化のグラフ用）
+-- karuta_decks への保存・削除のたびにトリガーで差分更新する。
+-- 集計値の定義は placement_trends.deck_metrics と同じ：
+--   decks       配置の数
+--   l_top 〜 r_low  各段に置いた札の枚数
+--   ichiji      決まり字が1字の札の枚数 / ichiji_low そのうち下段に置いた枚数
+--   tomo_pairs  1字目が同じ札の組の数 / tomo_split そのうち左右に分かれている組の数
+-- 配置は karuta_deck_placement（JSON の列、なければ placement_code）から読むので、
+-- 先に karuta_decks_placement_code.sql を実行しておく。
+
+create table if not exists karuta_placement_rollups (
+    day date not null,
+    metric text not null,
+    value bigint not null default 0,
+    primary key (day, metric)
+);
+
+create or replace function karuta_placement_metrics(placement jsonb)
+returns table (metric text, value bigint)
+language sql immutable as $$
+    with cards as (
+        select p.key as zone, f.k, left(p.key, 1) as side
+        from jsonb_each(placement) as p,
+             jsonb_array_elements_text(p.value) as f(k)
+    ),
+    sides as (
+        select left(k, 1) as sound,
+               count(*) filter (where side = 'l') as l,
+               count(*) filter (where side = 'r') as r
+        from cards
+        group by left(k, 1)
+    )
+    select 'decks', 1::bigint
+    union all
+    select zone, count(*) from cards group by zone
+    union all
+    select 'ichiji', count(*) from cards where char_length(k) = 1
+    union all
+    select 'ichiji_low', count(*) from cards where char_length(k) = 1 and zone in ('l_low', 'r_low')
+    union all
+    select 'tomo_pairs', coalesce(sum((l + r) * (l + r - 1) / 2), 0)::bigint from sides
+    union all
+    select 'tomo_split', coalesce(sum(l * r), 0)::bigint from sides
+$$;
+
+create or replace function karuta_apply_placement_rollups() returns trigger
+language plpgsql as $$
+declare
+    d karuta_decks%rowtype;
+    sign bigint;
+begin
+    if tg_op = 'INSERT' then
+        d := new;
+        sign := 1;
+    else
+        d := old;
+        sign := -1;
+    end if;
+    insert into karuta_placement_rollups (day, metric, value)
+    select (d.created_at at time zone 'utc')::date, m.metric, sign * m.value
+    from karuta_placement_metrics(karuta_deck_placement(d.placement::jsonb, d.placement_code)) as m
+    where m.value <> 0
+    on conflict (day, metric)
+    do update set value = karuta_placement_rollups.value + excluded.value;
+    return d;
+end;
+$$;
+
+drop trigger if exists karuta_decks_placement_rollups on karuta_decks;
+create trigger karuta_decks_placement_rollups
+after insert or delete on karuta_decks
+for each row execute function karuta_apply_placement_rollups();
+
+-- 既存データからの初期集計（トリガー作成後に一度だけ実行）
+truncate karuta_placement_rollups;
+insert into karuta_placement_rollups (day, metric, value)
+select (d.created_at at time zone 'utc')::date, m.metric, sum(m.value)
+from karuta_decks d,
+     karuta_placement_metrics(karuta_deck_placement(d.placement::jsonb, d.placement_code)) as m
+where m.value <> 0
+group by 1, 2;
@@ -0,0 +1,13 @@
+-- 暗記トレーニングの回答イベント（札 × 段ごとの記録）
+-- アプリは回答をためておき、まとめて insert する（recall_scheduler.RecallEventWriter）。
+
+create table if not exists karuta_recall_events (
+    id bigint generated always as identity primary key,
+    card text not null,
+    zone text not null,
+    answer text,
+    correct boolean not null,
+    answered_at timestamptz not null default now()
+);
+
+create index if not exists karuta_recall_events_answered_at on karuta_recall_events (answered_at);
@@ -0,0 +1,464 @@
+import json
+import sqlite3
+import threading
+from collections import Counter
+
+from fuda_index import ZONES
+from placement_codec import PlacementCodec
+from placement_trends import PlacementTrends
+
+DECK_LIST_COLUMNS = ("id", "deck_name", "created_at")
+# 配置の中身の列。placement_code（placement_codec.py）に移行する前の行は JSON の2列だけを持つ
+DECK_COLUMNS = ("id", "deck_name", "created_at", "placement_code", "selected_fuda", "placement")
+LEGACY_DECK_COLUMNS = ("id", "deck_name", "created_at", "selected_fuda", "placement")
+# PostgreSQL の「列が存在しない」エラーのコード（placement_code 列の確認に使う）
+UNDEFINED_COLUMN = "42703"
+
+
+class DeckStorage:
+    """保存済み配置（karuta_decks）の読み書きをまとめたインターフェース。
+
+    デッキは {"deck_name", "selected_fuda", "placement"} の辞書で受け取り、
+    保存後の行には "id" と "created_at" が付く（インポートなどで "created_at" を渡した場合はその日時で保存する）。保存先には配置コード（placement_code）として書き込み、
+    読み込むときに元の辞書に戻す。
+    """
+
+    name = "base"
+    codec = None
+
+    def _decode_row(self, row):
+        deck = dict(row)
+        if deck.get('placement_code'):
+            deck['placement'], deck['selected_fuda'] = self.codec.decode(deck['placement_code'])
+        return deck
+
+    def find_decks_by_code(self, placement_code):
+        # 同じ配置（配置コードが等しいもの）の id・名前・作成日時
+        raise NotImplementedError
+
+    def existing_codes(self, placement_codes):
+        # 一括インポートの重複確認用。すでに保存されている配置コードの集合
+        return {code for code in placement_codes if self.find_decks_by_code(code)}
+
+    def insert_decks(self, decks):
+        raise NotImplementedError
+
+    def insert_deck(self, deck):
+        rows = self.insert_decks([deck])
+        return rows[0] if rows else None
+
+    def list_decks(self, offset, limit):
+        # 新しい順に id・名前・作成日時だけを返す
+        raise NotImplementedError
+
+    def get_deck(self, deck_id):
+        raise NotImplementedError
+
+    def iter_placements(self, page_size=1000):
+        raise NotImplementedError
+
+    def iter_decks(self, page_size=500):
+        # 画像の一括書き出しなど、全デッキを id 順にページ単位で読み込む
+        raise NotImplementedError
+
+    def position_count_rows(self):
+        # 札 × 位置の集計行 {"fuda", "position", "count"}。集計テーブルがない保存先では配置から数える
+        counter = Counter()
+        for placement in self.iter_placements():
+            for pos in ZONES:
+                for fuda_name in placement.get(pos, []):
+                    counter[(fuda_name, pos)] += 1
+        return [{"fuda": f, "position": p, "count": n} for (f, p), n in counter.items()]
+
+    def insert_recall_events(self, events):
+        # 暗記の回答イベント {"card", "zone", "answer", "correct", "answered_at"} をまとめて保存する
+        raise NotImplementedError
+
+    def recall_events(self):
+        # 暗記の回答イベントを回答した順に返す
+        raise NotImplementedError
+
+    def rollup_rows(self, start=None, end=None):
+        # 日ごとの集計行 {"day", "metric", "value"}（start 以上 end 未満の日付）。集計テーブルがない保存先では配置から数える
+        rows = PlacementTrends.from_decks(self.iter_decks()).to_rows()
+        return [r for r in rows if (start is None or r['day'] >= start) and (end is None or r['day'] < end)]
+
+
+class SupabaseStorage(DeckStorage):
+    name = "supabase"
+
+    def __init__(self, client, codec=None):
+        self.client = client
+        self.codec = codec or PlacementCodec.default()
+        self._compact = None
+
+    @property
+    def compact(self):
+        # placement_code 列があるか（sql/karuta_decks_placement_code.sql を実行済みか）を確かめる。
+        # 列があると分かれば覚えておく。列がないときは覚えず（移行後に切り替わる）、通信エラーなどはそのまま伝える
+        if not self._compact:
+            try:
+                self.client.table("karuta_decks").select("placement_code").limit(1).execute()
+            except Exception as e:
+                if getattr(e, "code", None) == UNDEFINED_COLUMN:
+                    return False
+                raise
+            self._compact = True
+        return self._compact
+
+    def _deck_columns(self):
+        return ", ".join(DECK_COLUMNS if self.compact else LEGACY_DECK_COLUMNS)
+
+    def insert_decks(self, decks):
+        if self.compact:
+            rows = []
+            for d in decks:
+                row = {"deck_name": d['deck_name'], "placement_code": self.codec.encode(d['placement'], d['selected_fuda'])}
+                if d.get('created_at'):
+                    row['created_at'] = d['created_at']
+                rows.append(row)
+        else:
+            # 日時を指定しない行は created_at を送らない
+            rows = [{k: v for k, v in d.items() if k != 'created_at' or v} for d in decks]
+        # 複数行をまとめて送ると、既定では一部の行にしかない列（created_at）が他の行で NULL になる。
+        # default_to_null=False で、値のない列は列の既定値（保存した日時）にする
+        response = self.client.table("karuta_decks").insert(rows, default_to_null=False).execute()
+        return [self._decode_row(row) for row in response.data]
+
+    def list_decks(self, offset, limit):
+        res = (
+            self.client.table("karuta_decks")
+            .select(", ".join(DECK_LIST_COLUMNS))
+            .order("created_at", desc=True)
+            .range(offset, offset + limit - 1)
+            .execute()
+        )
+        return res.data
+
+    def get_deck(self, deck_id):
+        res = self.client.table("karuta_decks").select(self._deck_columns()).eq("id", deck_id).limit(1).execute()
+        return self._decode_row(res.data[0]) if res.data else None
+
+    def find_decks_by_code(self, placement_code):
+        if not self.compact:
+            return []
+        res = (
+            self.client.table("karuta_decks")
+            .select(", ".join(DECK_LIST_COLUMNS))
+            .eq("placement_code", placement_code)
+            .execute()
+        )
+        return res.data
+
+    def existing_codes(self, placement_codes):
+        if not self.compact or not placement_codes:
+            return set()
+        res = (
+            self.client.table("karuta_decks")
+            .select("placement_code")
+            .in_("placement_code", list(placement_codes))
+            .execute()
+        )
+        return {row['placement_code'] for row in res.data}
+
+    def iter_placements(self, page_size=1000):
+        columns = "placement_code, placement" if self.compact else "placement"
+        start = 0
+        while True:
+            res = self.client.table("karuta_decks").select(columns).range(start, start + page_size - 1).execute()
+            for row in res.data:
+                yield self._decode_row(row)['placement']
+            if len(res.data) < page_size:
+                break
+            start += page_size
+
+    def iter_decks(self, page_size=500):
+        start = 0
+        while True:
+            res = (
+                self.client.table("karuta_decks")
+                .select(self._deck_columns())
+                .order("id")
+                .range(start, start + page_size - 1)
+                .execute()
+            )
+            for row in res.data:
+                yield self._decode_row(row)
+            if len(res.data) < page_size:
+                break
+            start += page_size
+
+    def position_count_rows(self):
+        # 集計テーブル（sql/karuta_fuda_position_counts.sql）がまだない場合は配置から数える
+        try:
+            return self.client.table("karuta_fuda_position_counts").select("fuda, position, count").execute().data
+        except Exception:
+            return super().position_count_rows()
+
+    def insert_recall_events(self, events):
+        self.client.table("karuta_recall_events").insert(list(events)).execute()
+
+    def recall_events(self, page_size=1000):
+        # テーブル（sql/karuta_recall_events.sql）がまだない場合は記録なしとして扱う
+        try:
+            rows = []
+            while True:
+                res = (
+                    self.client.table("karuta_recall_events")
+                    .select("card, zone, answer, correct, answered_at")
+                    .order("answered_at")
+                    .range(len(rows), len(rows) + page_size - 1)
+                    .execute()
+                )
+                rows.extend(res.data)
+                if len(res.data) < page_size:
+                    return rows
+        except Exception:
+            return []
+
+    def rollup_rows(self, start=None, end=None, page_size=1000):
+        # 集計テーブル（sql/karuta_placement_rollups.sql）がまだない場合は配置から数える
+        try:
+            rows = []
+            while True:
+                query = self.client.table("karuta_placement_rollups").select("day, metric, value")
+                if start is not None:
+                    query = query.gte("day", start)
+                if end is not None:
+                    query = query.lt("day", end)
+                res = query.order("day").order("metric").range(len(rows), len(rows) + page_size - 1).execute()
+                rows.extend(res.data)
+                if len(res.data) < page_size:
+                    return rows
+        except Exception:
+            return super().rollup_rows(start, end)
+
+
+class SQLiteStorage(DeckStorage):
+    """オフライン用のローカル保存先。
+
+    接続は1つを使い回し（アプリ側で st.cache_resource に載せる）、
+    複数デッキの保存は1トランザクションでまとめて書き込む。
+    札 × 位置の集計テーブルと日ごとの集計テーブルも同じトランザクションで更新する。
+    配置は配置コード（placement_code）の1列だけで持つ。
+    """
+
+    name = "sqlite"
+
+    DECKS_TABLE = """
+        create table if not exists karuta_decks (
+            id integer primary key autoincrement,
+            deck_name text not null,
+            placement_code text not null,
+            created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+        )
+    """
+    SCHEMA = DECKS_TABLE + """;
+        create index if not exists karuta_decks_placement_code on karuta_decks (placement_code);
+        create index if not exists karuta_decks_created_at on karuta_decks (created_at desc, id desc);
+        create table if not exists karuta_fuda_position_counts (
+            fuda text not null,
+            position text not null,
+            count integer not null default 0,
+            primary key (fuda, position)
+        ) without rowid;
+        create table if not exists karuta_placement_rollups (
+            day text not null,
+            metric text not null,
+            value integer not null default 0,
+            primary key (day, metric)
+        ) without rowid;
+        create table if not exists karuta_recall_events (
+            id integer primary key autoincrement,
+            card text not null,
+            zone text not null,
+            answer text,
+            correct integer not null,
+            answered_at text not null
+        );
+    """
+
+    def __init__(self, path, codec=None):
+        self.path = path
+        self.codec = codec or PlacementCodec.default()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("pragma journal_mode = wal")
+            self._migrate_json_columns()
+            self.conn.executescript(self.SCHEMA)
+            # 日ごとの集計テーブルを後から追加したファイルでは、既存の配置から一度だけ集計する
+            has_rollups = self.conn.execute("select 1 from karuta_placement_rollups limit 1").fetchone()
+            if not has_rollups:
+                rows = self.conn.execute("select placement_code, created_at from karuta_decks").fetchall()
+                trends = PlacementTrends.from_decks(self._decode_row(r) for r in rows)
+                self._add_rollups(trends.to_rows())
+
+    def _migrate_json_columns(self):
+        # 配置を JSON の2列（selected_fuda, placement）で持っていた古いファイルを、配置コードの1列に作り直す
+        columns = {row['name'] for row in self.conn.execute("pragma table_info(karuta_decks)")}
+        if "placement" not in columns:
+            return
+        rows = self.conn.execute("select id, deck_name, selected_fuda, placement, created_at from karuta_decks").fetchall()
+        self.conn.execute("begin")
+        self.conn.execute("alter table karuta_decks rename to karuta_decks_json")
+        self.conn.execute(self.DECKS_TABLE)
+        self.conn.executemany(
+            "insert into karuta_decks (id, deck_name, placement_code, created_at) values (?, ?, ?, ?)",
+            [
+                (r['id'], r['deck_name'],
+                 self.codec.encode(json.loads(r['placement']), json.loads(r['selected_fuda'])), r['created_at'])
+                for r in rows
+            ]
+        )
+        self.conn.execute("drop table karuta_decks_json")
+        self.conn.commit()
+
+    def _add_rollups(self, rows):
+        self.conn.executemany(
+            "insert into karuta_placement_rollups (day, metric, value) values (:day, :metric, :value) "
+            "on conflict (day, metric) do update set value = value + excluded.value",
+            rows
+        )
+
+    def insert_decks(self, decks):
+        decks = list(decks)
+        counter = Counter()
+        for deck in decks:
+            for pos in ZONES:
+                for fuda_name in deck['placement'].get(pos, []):
+                    counter[(fuda_name, pos)] += 1
+
+        with self.lock, self.conn:
+            first_id = None
+            for deck in decks:
+                code = self.codec.encode(deck['placement'], deck['selected_fuda'])
+                if deck.get('created_at'):
+                    # 既定値と同じ UTC の書式にそろえて、並び順と日付の区切りを保存した日時と一致させる
+                    cur = self.conn.execute(
+                        "insert into karuta_decks (deck_name, placement_code, created_at) "
+                        "values (?, ?, strftime('%Y-%m-%dT%H:%M:%f', ?))",
+                        (deck['deck_name'], code, deck['created_at'])
+                    )
+                else:
+                    cur = self.conn.execute(
+                        "insert into karuta_decks (deck_name, placement_code) values (?, ?)", (deck['deck_name'], code)
+                    )
+                if first_id is None:
+                    first_id = cur.lastrowid
+            self.conn.executemany(
+                "insert into karuta_fuda_position_counts (fuda, position, count) values (?, ?, ?) "
+                "on conflict (fuda, position) do update set count = count + excluded.count",
+                [(f, p, n) for (f, p), n in counter.items()]
+            )
+            if first_id is None:
+                return []
+            rows = self.conn.execute(
+                "select * from karuta_decks where id >= ? order by id limit ?", (first_id, len(decks))
+            ).fetchall()
+            saved = [self._decode_row(row) for row in rows]
+            self._add_rollups(PlacementTrends.from_decks(saved).to_rows())
+        return saved
+
+    def list_decks(self, offset, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                "select id, deck_name, created_at from karuta_decks order by created_at desc, id desc limit ? offset ?",
+                (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_deck(self, deck_id):
+        with self.lock:
+            row = self.conn.execute("select * from karuta_decks where id = ?", (deck_id,)).fetchone()
+        return self._decode_row(row) if row else None
+
+    def find_decks_by_code(self, placement_code):
+        with self.lock:
+            rows = self.conn.execute(
+                "select id, deck_name, created_at from karuta_decks where placement_code = ? order by id", (placement_code,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def existing_codes(self, placement_codes):
+        placement_codes = list(placement_codes)
+        if not placement_codes:
+            return set()
+        with self.lock:
+            rows = self.conn.execute(
+                f"select placement_code from karuta_decks where placement_code in ({', '.join('?' * len(placement_codes))})",
+                placement_codes
+            ).fetchall()
+        return {row['placement_code'] for row in rows}
+
+    def iter_placements(self, page_size=1000):
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "select id, placement_code from karuta_decks where id > ? order by id limit ?", (last_id, page_size)
+                ).fetchall()
+            for row in rows:
+                yield self.codec.decode(row['placement_code'])[0]
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1]['id']
+
+    def iter_decks(self, page_size=500):
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "select * from karuta_decks where id > ? order by id limit ?", (last_id, page_size)
+                ).fetchall()
+            for row in rows:
+                yield self._decode_row(row)
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1]['id']
+
+    def position_count_rows(self):
+        with self.lock:
+            rows = self.conn.execute("select fuda, position, count from karuta_fuda_position_counts where count > 0").fetchall()
+        return [dict(row) for row in rows]
+
+    def insert_recall_events(self, events):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "insert into karuta_recall_events (card, zone, answer, correct, answered_at) "
+                "values (:card, :zone, :answer, :correct, :answered_at)",
+                [dict(e, correct=int(bool(e['correct']))) for e in events]
+            )
+
+    def recall_events(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "select card, zone, answer, correct, answered_at from karuta_recall_events order by answered_at, id"
+            ).fetchall()
+        return [dict(row, correct=bool(row['correct'])) for row in rows]
+
+    def rollup_rows(self, start=None, end=None):
+        with self.lock:
+            rows = self.conn.execute(
+                "select day, metric, value from karuta_placement_rollups "
+                "where day >= coalesce(?, '') and (? is null or day < ?) order by day, metric",
+                (start, end, end)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def open_storage(settings):
+    """設定（st.secrets など）から保存先を選ぶ。
+
+    STORAGE_BACKEND が "sqlite" か、Supabase の接続情報がない場合はローカルの SQLite を使う。
+    """
+    backend = settings.get("STORAGE_BACKEND")
+    if backend is None:
+        backend = "supabase" if settings.get("SUPABASE_URL") else "sqlite"
+    if backend == "supabase":
+        from supabase import create_client
+        return SupabaseStorage(create_client(settings["SUPABASE_URL"], settings["SUPABASE_KEY"]))
+    if backend == "sqlite":
+        return SQLiteStorage(settings.get("SQLITE_PATH") or "karuta_decks.db")
+    raise ValueError(f"不明な保存先です: {backend}")
@@ -1,30 +1,129 @@
+import datetime
+import io
 import streamlit as st
-import json
-import os
-from collections import Counter
-from supabase import create_client, Client
 import plotly.express as px
 import pandas as pd
-
-# --- Supabase接続 ---
-# Secretsから取得
-url = st.secrets["SUPABASE_URL"]
-key = st.secrets["SUPABASE_KEY"]
-supabase = create_client(url, key)
+from fuda_index import FudaIndex, ZONES, ZONE_LABELS, load_fuda_json
+from placement_rules import PlacementRuleEngine, RULES
+from kimariji_trie import KimarijiTrie
+from placement_stats import PlacementCounts
+from placement_search import suggest_placements
+from match_simulator import MatchSimulator
+from board_image import board_bytes, export_zip
+from deck_similarity import PlacementVectorIndex
+from placement_trends import PERIODS, PlacementTrends
+from placement_codec import PlacementCodec
+from fuda_search import FudaSearchIndex
+from recall_scheduler import RecallEventWriter, RecallScheduler, now_iso
+from okurifuda import OkurifudaAdvisor
+from deck_transfer import FORMATS, export_lines, format_of, import_decks, read_records
+from storage import open_storage
+from profiler import RerunProfiler, ProfiledStorage
+
+# --- 保存先の接続 ---
+# Secretsに Supabase の接続情報があれば Supabase、なければローカルの SQLite を使う
+def get_secret(name, default=None):
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        # secrets.toml がない場合
+        return default
+
+@st.cache_resource
+def get_storage():
+    return open_storage({
+        name: get_secret(name)
+        for name in ("STORAGE_BACKEND", "SUPABASE_URL", "SUPABASE_KEY", "SQLITE_PATH")
+    })
+
+# 計測モード（?profile=1 または Secrets の PROFILE）では、セクションごとの処理時間と保存先の呼び出しを記録する
+if 'profiler' not in st.session_state:
+    profile_flag = st.query_params.get("profile") or get_secret("PROFILE")
+    st.session_state.profiler = RerunProfiler(enabled=str(profile_flag).lower() in ("1", "true", "yes"))
+profiler = st.session_state.profiler
+profiler.begin_run()
+
+storage = get_storage()
+if profiler.enabled:
+    storage = ProfiledStorage(storage, profiler)
 
 # --- 1. データの読み込み ---
 @st.cache_data
 def load_fuda_data():
-    current_dir = os.path.dirname(__file__)
-    file_path = os.path.join(current_dir, 'fuda.json')
-    if not os.path.exists(file_path):
-        return []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-fuda_list = load_fuda_data()
-if fuda_list:
-    fuda_list = sorted(fuda_list, key=lambda x: x['kimariji'])
+    return load_fuda_json()
+
+# 札の索引と診断エンジン・決まり字トライ木は起動時に一度だけ作る
+@st.cache_resource
+def get_fuda_index():
+    return FudaIndex(load_fuda_data())
+
+@st.cache_resource
+def get_rule_engine():
+    return PlacementRuleEngine(get_fuda_index())
+
+@st.cache_resource
+def get_search_index():
+    return FudaSearchIndex(get_fuda_index())
+
+@st.cache_resource
+def get_placement_codec():
+    return PlacementCodec(get_fuda_index())
+
+@st.cache_resource
+def get_kimariji_trie():
+    return KimarijiTrie(get_fuda_index())
+
+# 決まり字順に並んだ札（索引と同じリストを使い回す）
+fuda_list = get_fuda_index().cards
+rule_engine = get_rule_engine()
+kimariji_trie = get_kimariji_trie()
+
+# 試合シミュレーション（配置ごとに結果をキャッシュする）
+SIMULATION_GAMES = 20000
+# 配置の自動提案で同時に走らせる探索プロセスの数（上限は placement_search.MAX_WORKERS）
+SUGGESTION_WORKERS = 2
+
+@st.cache_resource
+def get_match_simulator():
+    return MatchSimulator(get_fuda_index())
+
+# 配置図の画像（同じ配置なら作り直さない）
+@st.cache_data(show_spinner=False, max_entries=32)
+def placement_image(placement_items, fmt):
+    return board_bytes(dict(placement_items), fmt=fmt)
+
+@st.cache_data(show_spinner="試合をシミュレーションしています...", max_entries=64)
+def simulate_placement(placement_items, games):
+    return get_match_simulator().simulate(dict(placement_items), games=games, seed=0)
+
+# 診断ルールごとのアドバイス文
+RULE_ADVICES = {
+    "ichiji": """
+            **【1字決まりの配置】**
+            決まり字が1字の札がすべて下段に配置されていないようです。自陣下段に配置することで、相手に取られにくく自分がすぐに反応し取ることができる配置になります。
+            また右下段と左下段で、取る1字の札を分けることも重要です。右と左で、どちらの方がよく反応して取ることができるのかを練習するなかで見つけましょう。
+            """,
+    "niji": """
+            **【2字決まりの配置】**
+            決まり字が2字の札が上段に多く配置されているようです。このままでは、相手にすぐ攻められる配置です。
+            中段以下に多く配置することで、札との距離が相手よりも自分との方が近くなり、より取りやすくなります。
+            """,
+    "tomo": """
+            **【友札の配置】**
+            友札が隣り合って配置されているようです。そのように配置することで、自陣で取りやすい一方、相手側も狙いやすい配置となってしまいます。
+            最初のうちは離して配置することをお勧めします。競技かるたに慣れてきて、くっつけた方が取りやすいと判断した際はそのようにするとよいと思います。
+            """,
+    "scatter": """
+            **【音の分散】**
+            同じ音から始まる札がかたまって配置されているようです。この場合、相手は音を聞いただけでそのエリアに手を出し、自分よりも先に札に触ることが考えられます。
+            相手が攻めづらい配置にするためにも、なるべく同じ音から始まる札が散らばるような配置を考えましょう。
+            """,
+    "oyama": """
+            **【大山札の配置】**
+            大山札が下段の端（内側か外側）に配置されていないようです。大山札を取る際は、手で札を囲うことで相手から守る必要があります。
+            中段などでは正確に囲うことができないため、下段の端に配置しましょう。
+            """,
+}
 
 # --- 2. セッション状態の初期化 ---
 if 'selected_fuda' not in st.session_state:
@@ -37,10 +136,67 @@ if 'placement' not in st.session_state:
 
 st.set_page_config(page_title="競技かるた配置サポーター", layout="wide")
 
-# --- 3. Supabase連携機能 (保存と読込) ---
+# 各フェーズはフラグメントとして個別に再実行される。
+# 25枚の選択がそろった／崩れたとき、配置の中身（提案の読み込みを含む）や読まれた札、相手の配置が変わったときは
+# 他のフェーズ（暗記・送り札・似ている配置）の表示も変わるので、アプリ全体を再実行する
+def phase_state():
+    placement = tuple(tuple(st.session_state.get(pos, [])) for pos in ZONES)
+    opponent = tuple(tuple(st.session_state.get(f"opp_{pos}", [])) for pos in ZONES)
+    return (len(st.session_state.selected_fuda) == 25, placement, tuple(st.session_state.get("read_history", [])), opponent)
+
+st.session_state.rendered_phase_state = phase_state()
+
+def rerun_app_if_phase_changed():
+    if phase_state() != st.session_state.rendered_phase_state:
+        st.rerun()
+
+# 保存済み配置の再採点の表示名
+RULE_LABELS = {
+    "ichiji": "1字決まりの配置", "niji": "2字決まりの配置", "tomo": "友札の配置",
+    "scatter": "音の分散", "oyama": "大山札の配置",
+}
+
+# --- 3. 保存と読込 ---
 st.sidebar.header("💾 保存済みデータ")
 
-def save_to_supabase(name):
+if st.session_state.get("save_message"):
+    st.sidebar.success(st.session_state.pop("save_message"))
+
+# 一覧は id・名前・作成日時だけをページ単位で取得し、一定時間キャッシュする
+DECK_PAGE_SIZE = 50
+DECK_CACHE_TTL = 600
+
+@st.cache_data(ttl=DECK_CACHE_TTL, show_spinner=False)
+def list_decks(page):
+    return storage.list_decks(page * DECK_PAGE_SIZE, DECK_PAGE_SIZE)
+
+# 札 × 位置の集計は保存先の集計テーブル karuta_fuda_position_counts から読む。
+# 保存時は save_deck で差分を反映する。
+@st.cache_resource(ttl=DECK_CACHE_TTL, show_spinner=False)
+def get_position_counts():
+    return PlacementCounts.from_rows(get_fuda_index(), storage.position_count_rows())
+
+# 似ている配置の検索用の索引（保存時は save_deck で1件ずつ追加する）
+@st.cache_resource(ttl=DECK_CACHE_TTL, show_spinner="配置の索引を作成しています...")
+def get_similarity_index():
+    return PlacementVectorIndex.from_decks(get_fuda_index(), storage.iter_decks())
+
+# 日ごとの集計（karuta_placement_rollups）を期間を指定して読む。保存時はキャッシュを捨てる
+@st.cache_data(ttl=DECK_CACHE_TTL, show_spinner=False)
+def load_rollups(start, end):
+    return storage.rollup_rows(start, end)
+
+# 保存済みの配置をすべて読み、診断ルールごとに「問題あり」の件数を数える（ボタンを押したときだけ）
+@st.cache_data(ttl=DECK_CACHE_TTL, show_spinner="保存済みの配置を再採点しています...")
+def rescore_decks():
+    return rule_engine.count_issues(storage.iter_placements())
+
+# 配置の中身はロードするときだけ取得する
+@st.cache_data(ttl=DECK_CACHE_TTL, show_spinner=False)
+def fetch_deck(deck_id):
+    return storage.get_deck(deck_id)
+
+def save_deck(name):
     data = {
         "deck_name": name,
         "selected_fuda": st.session_state.selected_fuda,
@@ -49,24 +205,111 @@ def save_to_supabase(name):
             "r_top": st.session_state.r_top, "r_mid": st.session_state.r_mid, "r_low": st.session_state.r_low
         }
     }
-    response = supabase.table("karuta_decks").insert(data).execute()
-    if response.data:
-        st.sidebar.success(f"保存しました: {name}")
-
-def load_deck(deck):
+    # 同じ配置（配置コードが等しいもの）がすでに保存されていれば保存しない
+    duplicates = storage.find_decks_by_code(get_placement_codec().encode(data["placement"], data["selected_fuda"]))
+    if duplicates:
+        st.warning(f"同じ配置がすでに「{duplicates[0]['deck_name']}」として保存されています。")
+        return
+    # 保存前の集計・索引を先に読み込んでおき、保存後に差分だけ足す（二重計上を防ぐ）
+    position_counts = get_position_counts()
+    similarity_index = get_similarity_index()
+    saved = storage.insert_deck(data)
+    if saved:
+        list_decks.clear()
+        load_rollups.clear()
+        rescore_decks.clear()
+        position_counts.add(data["placement"])
+        similarity_index.add(saved['id'], data["placement"], name, saved.get('created_at', ""))
+        # 保存はフラグメントの中から呼ばれるので、サイドバーの一覧ごとアプリ全体を再実行して結果を表示する
+        st.session_state.save_message = f"保存しました: {name}"
+        st.rerun(scope="app")
+
+# 配置をマルチセレクトに反映する（ボタンの on_click から呼ぶとウィジェット作成前に代入できる）
+def apply_placement(placement):
+    for pos in ZONES:
+        st.session_state[pos] = list(placement.get(pos, []))
+
+def load_deck(deck_id):
+    deck = fetch_deck(deck_id)
+    if deck is None:
+        st.sidebar.warning("この配置は見つかりませんでした。")
+        return
     st.session_state.selected_fuda = deck['selected_fuda']
     st.session_state.placement = deck['placement']
+    # 配置のマルチセレクトにも反映する（ウィジェット作成前なのでここで代入できる）
+    apply_placement(deck['placement'])
     st.rerun()
 
-try:
-    decks_response = supabase.table("karuta_decks").select("*").order("created_at", desc=True).execute()
-    saved_decks = decks_response.data
-    if saved_decks:
-        deck_to_load = st.sidebar.selectbox("過去の配置をロード", saved_decks, format_func=lambda x: f"{x['deck_name']} ({x['created_at'][:10]})")
-        if st.sidebar.button("ロードする"):
-            load_deck(deck_to_load)
-except Exception as e:
-    st.sidebar.error(f"エラー内容: {e}")
+if 'deck_page' not in st.session_state:
+    st.session_state.deck_page = 0
+
+with profiler.section("sidebar"):
+    try:
+        saved_decks = list_decks(st.session_state.deck_page)
+        if saved_decks:
+            deck_to_load = st.sidebar.selectbox("過去の配置をロード", saved_decks, format_func=lambda x: f"{x['deck_name']} ({x['created_at'][:10]})")
+            if st.sidebar.button("ロードする"):
+                load_deck(deck_to_load['id'])
+
+        page_prev, page_next = st.sidebar.columns(2)
+        if page_prev.button("◀ 新しい", disabled=st.session_state.deck_page == 0):
+            st.session_state.deck_page -= 1
+            st.rerun()
+        if page_next.button("古い ▶", disabled=len(saved_decks) < DECK_PAGE_SIZE):
+            st.session_state.deck_page += 1
+            st.rerun()
+    except Exception as e:
+        st.sidebar.error(f"エラー内容: {e}")
+
+# 配置図の一括書き出し（名前で絞り込んだデッキを画像にして ZIP にまとめる）
+with st.sidebar.expander("🖼 配置図の一括書き出し"):
+    export_filter = st.text_input("配置名に含む文字（空欄ならすべて）", key="export_filter")
+    export_format = st.radio("形式", ["PNG", "JPG"], horizontal=True, key="export_format")
+    if st.button("ZIPを作成"):
+        with st.spinner("配置図を作成しています..."):
+            decks = (d for d in storage.iter_decks() if export_filter in d['deck_name'])
+            st.session_state.export_zip = export_zip(decks, export_format)
+    if st.session_state.get("export_zip"):
+        st.download_button("ZIPをダウンロード", st.session_state.export_zip, file_name="karuta_decks.zip", mime="application/zip")
+
+# 配置データの一括インポート・エクスポート（NDJSON / CSV）
+with st.sidebar.expander("📦 配置データのインポート・エクスポート"):
+    uploaded = st.file_uploader("NDJSON / CSV ファイル", type=["ndjson", "jsonl", "json", "csv"])
+    if uploaded is not None and st.button("インポート"):
+        progress_bar = st.progress(0.0, text="読み込んでいます...")
+        total_bytes = max(uploaded.size, 1)
+
+        def show_progress(read, imported, errors):
+            progress_bar.progress(
+                min(uploaded.tell() / total_bytes, 1.0), text=f"読み込み {read} 件 / 保存 {imported} 件 / エラー {errors} 件"
+            )
+
+        stream = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+        try:
+            report = import_decks(storage, read_records(stream, format_of(uploaded.name)), get_fuda_index(), progress=show_progress)
+        finally:
+            stream.detach()  # アップロードされたファイルを閉じないように切り離す
+            # 集計・索引は1件ずつの差分ではなく、まとめて読み直す（途中で失敗しても保存済みのチャンクは残るので必ず捨てる）
+            list_decks.clear()
+            load_rollups.clear()
+            rescore_decks.clear()
+            get_position_counts.clear()
+            get_similarity_index.clear()
+        st.success(f"保存 {report['imported']} 件、重複のため省略 {report['skipped']} 件、エラー {len(report['errors'])} 件")
+        if report['errors']:
+            st.dataframe(pd.DataFrame(report['errors'], columns=["行", "理由"]), hide_index=True)
+
+    transfer_format = st.radio("書き出す形式", FORMATS, horizontal=True, key="transfer_format")
+    if st.button("エクスポートを作成"):
+        with st.spinner("書き出しています..."):
+            buf = io.BytesIO()
+            # 保存先からページ単位で読みながら1行ずつ書き出す
+            for line in export_lines(storage.iter_decks(), transfer_format):
+                buf.write(line.encode("utf-8"))
+            st.session_state.export_file = (transfer_format, buf.getvalue())
+    if st.session_state.get("export_file"):
+        fmt, data = st.session_state.export_file
+        st.download_button("ダウンロード", data, file_name=f"karuta_decks.{fmt}", mime="text/csv" if fmt == "csv" else "application/x-ndjson")
 
 st.title("🎴 競技かるた配置サポーター ")
 
@@ -94,53 +337,94 @@ with st.expander("💡 初めての方へ：競技かるたの基本ルールと
     """)
     
 # --- 4. 札の選択フェーズ ---
-st.subheader(f"1. 自陣の25枚を選択 (現在: {len(st.session_state.selected_fuda)} / 25 枚)")
-if len(st.session_state.selected_fuda) > 0:
-    with st.expander("選択中の札を確認・リセット"):
-        st.write(", ".join(st.session_state.selected_fuda))
-        if st.button("選択をすべてクリア"):
-            st.session_state.selected_fuda = []
-            st.rerun()
+# チェックの付け外しはコールバックで選択リストに反映し、選択フェーズだけを再実行する
+def toggle_fuda(kimariji, key):
+    selected = st.session_state.selected_fuda
+    if st.session_state[key]:
+        if kimariji not in selected:
+            if len(selected) < 25:
+                selected.append(kimariji)
+            else:
+                st.session_state[key] = False
+                st.session_state.selection_limit_warning = True
+    elif kimariji in selected:
+        selected.remove(kimariji)
 
-st.divider()
-filter_type = st.radio("絞り込み", ["すべて", "一字決まり", "二字決まり", "大山札"], horizontal=True)
-tabs = st.tabs(["あ行", "か・さ行", "た・な行", "は・ま行", "や・ら・わ行"])
+def clear_selection():
+    st.session_state.selected_fuda = []
 
-def render_fuda_grid(target_chars):
-    filtered = [f for f in fuda_list if f['kimariji'][0] in target_chars]
+# 行（1字目の音）と決まり字の字数による絞り込みは、札番号のビット集合で行う
+FUDA_GROUPS = {
+    "あ行": "あいうえお", "か・さ行": "かきくけこさしすせそ", "た・な行": "たちつてとなにぬねの",
+    "は・ま行": "はひふへほまみむめも", "や・ら・わ行": "やゆよらりるれろわ"
+}
+
+def group_mask(target_chars):
+    index = get_fuda_index()
+    mask = 0
+    for ch in target_chars:
+        mask |= index.sound_masks.get(ch, 0)
+    return mask
+
+def type_filter_mask(filter_type):
+    index = get_fuda_index()
     if filter_type == "一字決まり":
-        filtered = [f for f in filtered if f['type'] == 1]
-    elif filter_type == "二字決まり":
-        filtered = [f for f in filtered if f['type'] == 2]
-    elif filter_type == "大山札":
-        filtered = [f for f in filtered if f['type'] >= 6]
-
+        return index.type_masks.get(1, 0)
+    if filter_type == "二字決まり":
+        return index.type_masks.get(2, 0)
+    if filter_type == "大山札":
+        return sum(m for t, m in index.type_masks.items() if t >= 6)
+    return index.all_mask
+
+def render_fuda_grid(filtered):
     cols = st.columns(3)
     for i, fuda in enumerate(filtered):
         with cols[i % 3]:
-            is_selected = fuda['kimariji'] in st.session_state.selected_fuda
-            if st.checkbox(f"{fuda['kimariji']} ({fuda['shimo'][:6]}...)", value=is_selected, key=f"select_{fuda['id']}"):
-                if fuda['kimariji'] not in st.session_state.selected_fuda:
-                    if len(st.session_state.selected_fuda) < 25:
-                        st.session_state.selected_fuda.append(fuda['kimariji'])
-                        st.rerun()
-                    else:
-                        st.warning("これ以上選択できません（上限25枚）")
-            else:
-                if fuda['kimariji'] in st.session_state.selected_fuda:
-                    st.session_state.selected_fuda.remove(fuda['kimariji'])
-                    st.rerun()
+            key = f"select_{fuda['id']}"
+            # クリアやロードで選択が変わってもチェック状態を合わせる
+            st.session_state[key] = fuda['kimariji'] in st.session_state.selected_fuda
+            st.checkbox(f"{fuda['kimariji']} ({fuda['shimo'][:6]}...)", key=key, on_change=toggle_fuda, args=(fuda['kimariji'], key))
+
+@st.fragment
+@profiler.track("selection")
+def selection_phase():
+    st.subheader(f"1. 自陣の25枚を選択 (現在: {len(st.session_state.selected_fuda)} / 25 枚)")
+    if len(st.session_state.selected_fuda) > 0:
+        with st.expander("選択中の札を確認・リセット"):
+            st.write(", ".join(st.session_state.selected_fuda))
+            st.button("選択をすべてクリア", on_click=clear_selection)
+
+    st.divider()
+    if st.session_state.pop("selection_limit_warning", False):
+        st.warning("これ以上選択できません（上限25枚）")
+    # 決まり字・上の句・下の句（ひらがな可）の一部で検索する。検索中は見つかった札だけを表示する
+    query = st.text_input("🔎 札を検索", placeholder="例：あきの、ころもて、夜ぞ更け", key="fuda_search")
+    filter_type = st.radio("絞り込み", ["すべて", "一字決まり", "二字決まり", "大山札"], horizontal=True)
+    type_mask = type_filter_mask(filter_type)
+
+    if query.strip():
+        found = get_search_index().search(query, type_mask)
+        if found:
+            st.caption(f"{len(found)} 枚見つかりました")
+            render_fuda_grid(found)
+        else:
+            st.info("見つかりませんでした。")
+    else:
+        # 表示するのは選んだ行の札だけ（タブだとすべての行の札を毎回描画することになる）
+        group = st.radio("行", list(FUDA_GROUPS), horizontal=True, key="fuda_group", label_visibility="collapsed")
+        render_fuda_grid(get_fuda_index().cards_of(group_mask(FUDA_GROUPS[group]) & type_mask))
+
+    rerun_app_if_phase_changed()
 
-with tabs[0]: render_fuda_grid("あいうえお")
-with tabs[1]: render_fuda_grid("かきくけこさしすせそ")
-with tabs[2]: render_fuda_grid("たちつてとなにぬねの")
-with tabs[3]: render_fuda_grid("はひふへほまみむめも")
-with tabs[4]: render_fuda_grid("やゆよらりるれろわ")
+selection_phase()
 
 st.divider()
 
 # --- 5. 盤面配置フェーズ ---
-if len(st.session_state.selected_fuda) == 25:
+# 配置の編集と診断は同じフラグメントで再実行する
+@st.fragment
+@profiler.track("placement")
+def placement_phase():
     st.header("2. 盤面配置")
     st.info("一度選んだ札は他の段には表示されなくなります。")
     
@@ -172,298 +456,568 @@ if len(st.session_state.selected_fuda) == 25:
 
     placed_count = len(all_placed_set)
     st.write(f"📊 現在の配置済み枚数: **{placed_count} / 25**")
+
+    # 配置図の画像書き出し
+    if placed_count == 25:
+        placement_items = tuple((pos, tuple(st.session_state[pos])) for pos in ZONES)
+        img_col1, img_col2 = st.columns(2)
+        img_col1.download_button("🖼 配置図をPNGで保存", placement_image(placement_items, "PNG"), file_name="karuta_placement.png", mime="image/png")
+        img_col2.download_button("🖼 配置図をJPGで保存", placement_image(placement_items, "JPG"), file_name="karuta_placement.jpg", mime="image/jpeg")
+
+    # 自動提案（診断ルールを満たす配置を探索する）
+    with st.expander("🤖 配置を自動で提案"):
+        sug_col1, sug_col2 = st.columns(2)
+        time_budget = sug_col1.slider("探索時間（秒）", 1, 10, 3)
+        top_n = sug_col2.slider("提案数", 1, 10, 3)
+        if st.button("提案を作成"):
+            with st.spinner("配置を探索しています..."):
+                st.session_state.suggestions = suggest_placements(
+                    base_options, time_budget=time_budget, top_n=top_n, workers=SUGGESTION_WORKERS
+                )
+
+        for n, (cost, suggestion) in enumerate(st.session_state.get("suggestions", []), start=1):
+            # 別の25枚を選び直した後の古い提案は表示しない
+            if set(sum(suggestion.values(), [])) != set(base_options):
+                continue
+            st.write(f"**提案 {n}**（評価値: {cost:.2f}、小さいほど良い）")
+            for pos in ZONES:
+                st.caption(f"{ZONE_LABELS[pos]}: {', '.join(suggestion[pos])}")
+            st.button("この配置を読み込む", key=f"apply_suggestion_{n}", on_click=apply_placement, args=(suggestion,))
     
     # 保存
     with st.expander("✨ この配置を保存する"):
         deck_name = st.text_input("配置名", placeholder="例：基本配置")
-        if st.button("Supabaseに保存"):
+        if st.button("保存する"):
             if deck_name:
-                save_to_supabase(deck_name)
+                save_deck(deck_name)
             else:
                 st.warning("名前を入力してください")
 
 # --- 7. 配置診断（改善版） ---
-    st.divider()
-    st.header("🔍 AI配置診断アドバイス")
-
-    all_placed_list = l_top + l_mid + l_low + r_top + r_mid + r_low
-
-    if len(all_placed_list) == 25:
-        advices = []
-        
-        # 札の分類準備
-        # fuda_listから情報を引き出すための辞書を作成
-        fuda_info = {f['kimariji']: f for f in fuda_list}
-        
-        # 各段の札リスト
-        top_tier = l_top + r_top
-        mid_tier = l_mid + r_mid
-        low_tier = l_low + r_low
-        mid_low_tier = mid_tier + low_tier
-
-        # 1. 決まり字が1字の札 (type == 1)
-        ichiji_fuda = [f for f in all_placed_list if fuda_info.get(f, {}).get('type') == 1]
-        ichiji_not_in_low = [f for f in ichiji_fuda if f not in low_tier]
-        if ichiji_not_in_low:
-            advices.append("""
-            **【1字決まりの配置】**
-            決まり字が1字の札がすべて下段に配置されていないようです。自陣下段に配置することで、相手に取られにくく自分がすぐに反応し取ることができる配置になります。
-            また右下段と左下段で、取る1字の札を分けることも重要です。右と左で、どちらの方がよく反応して取ることができるのかを練習するなかで見つけましょう。
-            """)
-
-        # 2. 決まり字が2字の札 (type == 2)
-        niji_fuda = [f for f in all_placed_list if fuda_info.get(f, {}).get('type') == 2]
-        if niji_fuda:
-            niji_in_mid_low = [f for f in niji_fuda if f in mid_low_tier]
-            # 3分の2以下の場合にアドバイス
-            if len(niji_in_mid_low) <= (len(niji_fuda) * 2 / 3):
-                advices.append("""
-                **【2字決まりの配置】**
-                決まり字が2字の札が上段に多く配置されているようです。このままでは、相手にすぐ攻められる配置です。
-                中段以下に多く配置することで、札との距離が相手よりも自分との方が近くなり、より取りやすくなります。
+    with profiler.section("diagnosis"):
+        st.divider()
+        st.header("🔍 AI配置診断アドバイス")
+
+        all_placed_list = l_top + l_mid + l_low + r_top + r_mid + r_low
+
+        # 試合中に読まれた札（自陣以外）を入れると、変化した決まり字で診断する
+        read_history = st.multiselect(
+            "既に読まれた札（試合の途中から診断する場合）",
+            options=[f['kimariji'] for f in fuda_list if f['kimariji'] not in base_options],
+            key="read_history"
+        )
+
+        if len(all_placed_list) == 25:
+            engine = rule_engine
+            if read_history:
+                current_kimariji = kimariji_trie.engine(all_placed_list, read_history).current()
+                changed = [f"{k}→{v}" for k, v in current_kimariji.items() if k != v]
+                if changed:
+                    st.caption("決まり字が変化した札: " + ", ".join(changed))
+                engine = rule_engine.with_kimariji(current_kimariji)
+
+            placement = {
+                "l_top": l_top, "l_mid": l_mid, "l_low": l_low,
+                "r_top": r_top, "r_mid": r_mid, "r_low": r_low
+            }
+            issues = engine.evaluate(placement)
+            advices = [RULE_ADVICES[rule] for rule in RULES if issues[rule]]
+
+            # --- 判定結果の表示 ---
+            if advices:
+                st.info("💡 **「自分が取りやすく、相手に攻められにくい配置」**を考えることが重要です。これに沿って、あなたの配置に対してアドバイスをします。")
+                for a in advices:
+                    st.write(a)
+            else:
+                st.balloons()
+                st.success("""
+                🎉 **よく考えられた配置です！**
+                これから自分の配置を覚えて、素早く札を取ることができるように練習を積んでいきましょう。
+                また、慣れてきたら、この配置に固執するのではなく、試合展開に応じて臨機応変に対応できるようになるとなお良いですね。
                 """)
 
-        # 3. 友札は分けて配置されているか
-        counts = Counter([f[0] for f in all_placed_list])
-        # 同じ音から始まる札（友札候補）
-        tomo_chars = [char for char, count in counts.items() if count > 1]
-        tomo_issue = False
-        for char in tomo_chars:
-            # 同じ段に同じ音の札が2枚以上あるかチェック
-            if any(len([f for f in tier if f.startswith(char)]) > 1 for tier in [l_top, l_mid, l_low, r_top, r_mid, r_low]):
-                tomo_issue = True
-                break
-        if tomo_issue:
-            advices.append("""
-            **【友札の配置】**
-            友札が隣り合って配置されているようです。そのように配置することで、自陣で取りやすい一方、相手側も狙いやすい配置となってしまいます。
-            最初のうちは離して配置することをお勧めします。競技かるたに慣れてきて、くっつけた方が取りやすいと判断した際はそのようにするとよいと思います。
-            """)
-
-        # 4. 同じ音から始まる札の分散
-        # 同じ側に同じ音が3枚以上固まっている場合などを判定
-        scatter_issue = False
-        for char in tomo_chars:
-            left_side = l_top + l_mid + l_low
-            right_side = r_top + r_mid + r_low
-            if len([f for f in left_side if f.startswith(char)]) >= 3 or len([f for f in right_side if f.startswith(char)]) >= 3:
-                scatter_issue = True
-                break
-        if scatter_issue:
-            advices.append("""
-            **【音の分散】**
-            同じ音から始まる札がかたまって配置されているようです。この場合、相手は音を聞いただけでそのエリアに手を出し、自分よりも先に札に触ることが考えられます。
-            相手が攻めづらい配置にするためにも、なるべく同じ音から始まる札が散らばるような配置を考えましょう。
-            """)
-
-        # 5. 大山札 (type == 6)
-        oyama_fuda = [f for f in all_placed_list if fuda_info.get(f, {}).get('type') == 6]
-        # 下段の端（各リストの最初か最後）にない場合
-        oyama_issue = False
-        for f in oyama_fuda:
-            if f not in [l_low[0] if l_low else "", l_low[-1] if l_low else "", r_low[0] if r_low else "", r_low[-1] if r_low else ""]:
-                oyama_issue = True
-                break
-        if oyama_issue:
-            advices.append("""
-            **【大山札の配置】**
-            大山札が下段の端（内側か外側）に配置されていないようです。大山札を取る際は、手で札を囲うことで相手から守る必要があります。
-            中段などでは正確に囲うことができないため、下段の端に配置しましょう。
-            """)
-
-        # --- 判定結果の表示 ---
-        if advices:
-            st.info("💡 **「自分が取りやすく、相手に攻められにくい配置」**を考えることが重要です。これに沿って、あなたの配置に対してアドバイスをします。")
-            for a in advices:
-                st.write(a)
+            # 試合のシミュレーションによる数値評価（ルール診断と並べて比較できるように）
+            st.subheader("📈 試合シミュレーションによる評価")
+            sim = simulate_placement(tuple((pos, tuple(placement[pos])) for pos in ZONES), SIMULATION_GAMES)
+            sim_col1, sim_col2, sim_col3 = st.columns(3)
+            sim_col1.metric("期待防御率（スコア）", f"{sim['score']:.1f}")
+            sim_col2.metric("平均の取り時間", f"{sim['mean_take_ms']:.0f} ms")
+            sim_col3.metric("攻められやすい段", ZONE_LABELS[max(sim['exposure'], key=sim['exposure'].get)])
+            with st.expander("札ごとの防御率"):
+                st.dataframe(
+                    pd.DataFrame([
+                        {"札": k, "位置": ZONE_LABELS[v['zone']], "防御率": round(v['defend_rate'], 3), "平均決まり字数": round(v['mean_sounds'], 2)}
+                        for k, v in sim['cards'].items()
+                    ]).sort_values("防御率"),
+                    hide_index=True, use_container_width=True
+                )
+            st.caption(f"※ランダムな相手陣と読み順で {sim['games']:,} 試合（{sim['reads']:,} 回の読み）をシミュレーションした推定値です。")
         else:
-            st.balloons()
-            st.success("""
-            🎉 **よく考えられた配置です！**
-            これから自分の配置を覚えて、素早く札を取ることができるように練習を積んでいきましょう。
-            また、慣れてきたら、この配置に固執するのではなく、試合展開に応じて臨機応変に対応できるようになるとなお良いですね。
-            """)
-    else:
-        st.warning("まず25枚すべての札を配置してください。")
+            st.warning("まず25枚すべての札を配置してください。")
+
+    rerun_app_if_phase_changed()
+
+if len(st.session_state.selected_fuda) == 25:
+    placement_phase()
 
 # --- 8. 統計分析フェーズ ---
 st.divider()
 st.header("📊 配置の傾向分析")
 
-if st.checkbox("保存データから配置のクセを分析する"):
-    try:
-        # Supabaseから全データを取得
-        res = supabase.table("karuta_decks").select("placement").execute()
-        all_decks = res.data
-
-        if not all_decks:
-            st.info("データがまだありません。まずは配置を保存してください。")
-        else:
-            # データの整形
-            positions = ["l_top", "l_mid", "l_low", "r_top", "r_mid", "r_low"]
-            pos_labels = {
-                "l_top": "左上段", "l_mid": "左中段", "l_low": "左下段",
-                "r_top": "右上段", "r_mid": "右中段", "r_low": "右下段"
-            }
-            
-            # 各札がどの位置に何回置かれたか集計
-            stats_data = []
-            for deck in all_decks:
-                placement = deck['placement']
-                for pos in positions:
-                    for fuda_name in placement.get(pos, []):
-                        stats_data.append({"fuda": fuda_name, "position": pos_labels[pos]})
-            
-            df = pd.DataFrame(stats_data)
-
-            # 分析対象の選択
-            analysis_target = st.selectbox("分析する札を選択", ["すべての札（総数）"] + sorted(list(df['fuda'].unique())))
+@st.fragment
+@profiler.track("analysis")
+def analysis_phase():
+    if st.checkbox("保存データから配置のクセを分析する"):
+        try:
+            # 札 × 位置の集計行列（保存件数に関係なく 100 × 6）
+            position_counts = get_position_counts()
 
-            if analysis_target == "すべての札（総数）":
-                plot_df = df['position'].value_counts().reindex(pos_labels.values()).fillna(0).reset_index()
-                plot_df.columns = ['位置', '配置回数']
-                title = "全札の配置分布（どの段がよく使われているか）"
+            if position_counts.total() == 0:
+                st.info("データがまだありません。まずは配置を保存してください。")
             else:
-                plot_df = df[df['fuda'] == analysis_target]['position'].value_counts().reindex(pos_labels.values()).fillna(0).reset_index()
-                plot_df.columns = ['位置', '配置回数']
-                title = f"札「{analysis_target}」の過去の配置傾向"
-
-            # 2x3のヒートマップ風に表示するための座標設定
-            grid_map = {
-                "左上段": [0, 0], "左中段": [1, 0], "左下段": [2, 0],
-                "右上段": [0, 1], "右中段": [1, 1], "右下段": [2, 1]
+                # 分析対象の選択
+                analysis_target = st.selectbox("分析する札を選択", ["すべての札（総数）"] + position_counts.placed_kimariji())
+
+                if analysis_target == "すべての札（総数）":
+                    zone_vector = position_counts.zone_totals()
+                    title = "全札の配置分布（どの段がよく使われているか）"
+                else:
+                    zone_vector = position_counts.card_counts(analysis_target)
+                    title = f"札「{analysis_target}」の過去の配置傾向"
+
+                # 可視化：Plotlyのヒートマップ（段 × 左右の 3 × 2）
+                fig = px.imshow(
+                    PlacementCounts.grid(zone_vector),
+                    labels=dict(x="左右", y="段", color="回数"),
+                    x=['左', '右'],
+                    y=['上段', '中段', '下段'],
+                    text_auto=True,
+                    color_continuous_scale="Reds",
+                    title=title
+                )
+                st.plotly_chart(fig, use_container_width=True)
+
+                with st.expander("札ごとの内訳"):
+                    breakdown = pd.DataFrame(
+                        position_counts.counts,
+                        index=position_counts.index.kimariji,
+                        columns=[ZONE_LABELS[z] for z in ZONES]
+                    )
+                    breakdown = breakdown[breakdown.sum(axis=1) > 0]
+                    st.dataframe(breakdown, use_container_width=True)
+
+                st.caption("※保存されたすべてのデッキデータから集計しています。")
+
+                # 保存済みの配置を今の診断ルールで採点し直す
+                if st.button("保存済みの配置を診断ルールで再採点する"):
+                    st.session_state.show_rescore = True
+                if st.session_state.get("show_rescore"):
+                    issue_counts, scored = rescore_decks()
+                    st.dataframe(
+                        pd.DataFrame([
+                            {"ルール": RULE_LABELS[rule], "問題ありの配置": issue_counts[rule], "割合": round(issue_counts[rule] / max(scored, 1), 3)}
+                            for rule in RULES
+                        ]),
+                        hide_index=True, use_container_width=True
+                    )
+                    st.caption(f"※保存済みの {scored:,} 件の配置を判定した結果です。")
+
+                # 配置の変遷：日ごとの集計を期間でまとめて推移を描く
+                st.subheader("📉 配置の変遷")
+                today = datetime.date.today()
+                trend_cols = st.columns(2)
+                with trend_cols[0]:
+                    date_range = st.date_input(
+                        "期間", value=(today - datetime.timedelta(days=365), today), max_value=today
+                    )
+                with trend_cols[1]:
+                    period_labels = dict(zip(PERIODS, ("日", "週", "月")))
+                    period = st.radio("集計単位", PERIODS, format_func=period_labels.get, index=1, horizontal=True)
+
+                if len(date_range) == 2:
+                    start, end = date_range
+                    rows = load_rollups(start.isoformat(), (end + datetime.timedelta(days=1)).isoformat())
+                    trend = pd.DataFrame(PlacementTrends.from_rows(rows).series(period))
+                    if trend.empty:
+                        st.info("この期間に保存された配置はありません。")
+                    else:
+                        ratio_labels = {"ichiji_low_ratio": "1字決まりを下段に置いた割合", "tomo_split_ratio": "友札を左右に分けた割合"}
+                        # 該当する札がない期間は None（欠損）になるので数値列にそろえる
+                        trend = trend.astype({c: float for c in list(ratio_labels) + list(ZONES)})
+                        fig = px.line(
+                            trend.rename(columns=ratio_labels), x="period", y=list(ratio_labels.values()),
+                            markers=True, labels={"period": "期間", "value": "割合", "variable": "指標"},
+                            hover_data={"decks": True}, range_y=[0, 1]
+                        )
+                        st.plotly_chart(fig, use_container_width=True)
+
+                        fig = px.area(
+                            trend.rename(columns=ZONE_LABELS), x="period", y=[ZONE_LABELS[z] for z in ZONES],
+                            labels={"period": "期間", "value": "札の割合", "variable": "段"}
+                        )
+                        st.plotly_chart(fig, use_container_width=True)
+
+        except Exception as e:
+            st.error(f"分析データの取得に失敗しました: {e}")
+
+analysis_phase()
+
+# --- 9. 送り札の提案 ---
+st.divider()
+st.header("🆚 相手の配置と送り札")
+
+# 相手の配置の入力（自陣と同じ6つのエリア。相手から見た左右・上中下で入力する）
+# 自陣にある札は相手陣に置けないので選択肢から外す
+def opponent_board_editor(own_cards=()):
+    opp_placed = set()
+    for pos in ZONES:
+        opp_placed.update(st.session_state.get(f"opp_{pos}", []))
+    opp_cols = st.columns(2)
+    for z, pos in enumerate(ZONES):
+        current = st.session_state.get(f"opp_{pos}", [])
+        excluded = (opp_placed | set(own_cards)) - set(current)
+        options = [f['kimariji'] for f in fuda_list if f['kimariji'] not in excluded]
+        with opp_cols[z // 3]:
+            st.multiselect(f"相手の{ZONE_LABELS[pos]}", options=options, key=f"opp_{pos}")
+    return opponent_board()
+
+def opponent_board():
+    return {pos: st.session_state.get(f"opp_{pos}", []) for pos in ZONES}
+
+# 友札・決まり字の重なりの表は最初に一度だけ作る（試合シミュレーションと同じ表を使い回す）
+@st.cache_resource
+def get_okurifuda_advisor():
+    return OkurifudaAdvisor(get_fuda_index(), get_match_simulator().lcp)
+
+def send_fuda(card, zone):
+    # 送った札を自陣から外し、相手陣の指定した段に置く
+    st.session_state.sent_fuda = st.session_state.get("sent_fuda", []) + [card]
+    st.session_state[f"opp_{zone}"] = st.session_state.get(f"opp_{zone}", []) + [card]
+
+def reset_sent_fuda():
+    sent = set(st.session_state.get("sent_fuda", []))
+    for pos in ZONES:
+        st.session_state[f"opp_{pos}"] = [k for k in st.session_state.get(f"opp_{pos}", []) if k not in sent]
+    st.session_state.sent_fuda = []
+
+@st.fragment
+@profiler.track("okurifuda")
+def okurifuda_phase():
+    own_placement = {pos: st.session_state.get(pos, []) for pos in ZONES}
+    own_cards = [k for pos in ZONES for k in own_placement[pos]]
+    sent = st.session_state.get("sent_fuda", [])
+    # 相手の配置は似ている配置の検索でも使うので、自陣が空でも入力できるようにする
+    with st.expander("相手の配置", expanded=True):
+        opp_placement = opponent_board_editor(set(own_cards) - set(sent))
+    # 相手の配置を変えたら、似ている配置の検索（別のフラグメント）にも反映する
+    rerun_app_if_phase_changed()
+    if not own_cards:
+        st.info("自陣に札を配置すると、送り札の候補を表示します。")
+        return
+
+    # 試合の途中の盤面：自陣から取られた札・送った札を除く
+    taken = st.multiselect(
+        "自陣から取られた札",
+        options=[k for k in own_cards if k not in sent],
+        key="own_taken"
+    )
+    own_now = {pos: [k for k in own_placement[pos] if k not in sent and k not in taken] for pos in ZONES}
+    read = st.session_state.get("read_history", []) + taken
+
+    ranking = get_okurifuda_advisor().rank(own_now, opp_placement, read)
+    if not ranking:
+        st.info("自陣に札が残っていません。")
+        return
+    if sum(len(v) for v in opp_placement.values()) == 0:
+        st.caption("相手の配置を入力すると、相手陣の友札も考えて順位付けします。")
+
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "順位": n, "札": r['card'], "位置": ZONE_LABELS[r['zone']],
+                "現在の決まり字": r['current_kimariji'],
+                "別れ札になる自陣の友札": "・".join(r['split']),
+                "相手陣にそろう友札": "・".join(r['grouped']),
+                "評価": round(r['score'], 1)
             }
-            plot_df['row'] = plot_df['位置'].map(lambda x: grid_map[x][0])
-            plot_df['col'] = plot_df['位置'].map(lambda x: grid_map[x][1])
-
-            # 可視化：Plotlyのヒートマップ
-            z_data = [[0, 0], [0, 0], [0, 0]]
-            for _, row in plot_df.iterrows():
-                z_data[row['row']][row['col']] = row['配置回数']
-
-            fig = px.imshow(
-                z_data,
-                labels=dict(x="左右", y="段", color="回数"),
-                x=['左', '右'],
-                y=['上段', '中段', '下段'],
-                text_auto=True,
-                color_continuous_scale="Reds",
-                title=title
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            for n, r in enumerate(ranking, start=1)
+        ]),
+        hide_index=True, use_container_width=True
+    )
+    st.caption("※自陣に残る友札・同じ音の札と別れる札、決まり字が長い札ほど上位に、相手陣に友札がある札ほど下位になります。")
+
+    send_col1, send_col2, send_col3 = st.columns([2, 2, 1])
+    # 盤面が変わると選択肢が変わり、1位の札が選ばれた状態に戻る
+    card = send_col1.selectbox("送る札", [r['card'] for r in ranking])
+    zone = send_col2.selectbox("相手が置いた段", ZONES, format_func=lambda z: ZONE_LABELS[z], key="okurifuda_zone")
+    send_col3.button("送る", on_click=send_fuda, args=(card, zone), use_container_width=True)
+    if sent:
+        st.caption("送った札: " + "・".join(sent))
+        st.button("送り札を元に戻す", on_click=reset_sent_fuda)
+
+okurifuda_phase()
+
+# --- 10. 似ている配置の検索 ---
+st.divider()
+st.header("🕵️ 似ている配置の検索")
+
+@st.fragment
+@profiler.track("similarity")
+def similarity_phase():
+    source = st.radio("検索する配置", ["現在の自陣", "相手の配置"], horizontal=True)
+    if source == "現在の自陣":
+        query = {pos: st.session_state.get(pos, []) for pos in ZONES}
+    else:
+        query = opponent_board()
 
-            st.caption("※保存されたすべてのデッキデータから集計しています。")
+    if sum(len(v) for v in query.values()) == 0:
+        st.info("配置を入力すると、保存済みの配置から似ているものを探します（相手の配置は上の「相手の配置と送り札」で入力します）。")
+        return
 
+    top_k = st.slider("表示件数", 1, 20, 5)
+    try:
+        results = get_similarity_index().query(query, k=top_k)
     except Exception as e:
-        st.error(f"分析データの取得に失敗しました: {e}")
-        
-# --- 9. 暗記トレーニングフェーズ ---
+        st.error(f"検索に失敗しました: {e}")
+        return
+    if not results:
+        st.info("似ている配置は見つかりませんでした。")
+        return
+    st.dataframe(
+        pd.DataFrame([
+            {"配置名": r['deck_name'], "作成日": r['created_at'][:10], "類似度": round(r['similarity'], 3)}
+            for r in results
+        ]),
+        hide_index=True, use_container_width=True
+    )
+    st.caption("※類似度は、同じ札が同じ段に置かれている割合（コサイン類似度）です。")
+
+similarity_phase()
+
+# --- 11. 暗記トレーニングフェーズ ---
 st.divider()
 st.header("🧠 暗記トレーニング")
 
-all_placed_list = (
-    st.session_state.get("l_top", []) + st.session_state.get("l_mid", []) + st.session_state.get("l_low", []) +
-    st.session_state.get("r_top", []) + st.session_state.get("r_mid", []) + st.session_state.get("r_low", [])
-)
-
 # 札をタイル状に表示する関数（関数定義はブロックの外で行うのが一般的）
-def display_karuta_row(label, fuda_list):
+# 試合中に決まり字が変化した札は「元→現在」の形で表示する
+def display_karuta_row(label, fuda_list, current_kimariji=None):
     st.write(f"**{label}**")
     if fuda_list:
         cols = st.columns(len(fuda_list))
         for i, fuda in enumerate(fuda_list):
-            cols[i].button(fuda, key=f"mem_{label}_{fuda}", disabled=True)
+            current = (current_kimariji or {}).get(fuda, fuda)
+            text = fuda if current == fuda else f"{fuda}→{current}"
+            cols[i].button(text, key=f"mem_{label}_{fuda}", disabled=True)
     else:
         st.write("（札なし）")
 
-if len(all_placed_list) < 25:
-    st.info("25枚すべての配置を完了させると、暗記テストを開始できます。")
-else:
-    if 'game_mode' not in st.session_state:
-        st.session_state.game_mode = "waiting" # waiting, memorizing, testing
-
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("暗記スタート！ (配置を表示)"):
-            st.session_state.game_mode = "memorizing"
-    with col2:
-        if st.button("テスト開始！ (配置を隠す)"):
-            st.session_state.game_mode = "testing"
-
-    # --- 暗記モード ---
-    if st.session_state.game_mode == "memorizing":
-        st.success("今のうちに配置を覚えましょう！")
+# 暗記の回答は札 × 段ごとに記録する。画面の更新は待たせず、保存は別スレッドでまとめて行う
+@st.cache_resource
+def get_recall_writer():
+    return RecallEventWriter(get_storage())
+
+@st.cache_data(ttl=DECK_CACHE_TTL, show_spinner=False)
+def load_recall_events():
+    return storage.recall_events()
+
+def get_recall_scheduler():
+    if 'recall_scheduler' not in st.session_state:
+        try:
+            events = load_recall_events()
+        except Exception:
+            events = []
+        st.session_state.recall_scheduler = RecallScheduler(events)
+    return st.session_state.recall_scheduler
+
+def log_recall(card, zone, answer):
+    event = {"card": card, "zone": zone, "answer": answer, "correct": answer == zone, "answered_at": now_iso()}
+    get_recall_scheduler().record(event)
+    get_recall_writer().put(event)
+    return event
+
+def start_drill():
+    placement = {pos: st.session_state.get(pos, []) for pos in ZONES}
+    st.session_state.drill = get_recall_scheduler().drill(placement)
+    st.session_state.drill_results = []
+    st.session_state.game_mode = "drill"
+
+def answer_drill(answer):
+    card, zone = st.session_state.drill[len(st.session_state.drill_results)]
+    st.session_state.drill_results.append(log_recall(card, zone, answer))
+
+@st.fragment
+@profiler.track("training")
+def training_phase():
+    base_options = st.session_state.selected_fuda
+    all_placed_list = (
+        st.session_state.get("l_top", []) + st.session_state.get("l_mid", []) + st.session_state.get("l_low", []) +
+        st.session_state.get("r_top", []) + st.session_state.get("r_mid", []) + st.session_state.get("r_low", [])
+    )
+
+    if len(all_placed_list) < 25:
+        st.info("25枚すべての配置を完了させると、暗記テストを開始できます。")
+    else:
+        if 'game_mode' not in st.session_state:
+            st.session_state.game_mode = "waiting" # waiting, memorizing, testing
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("暗記スタート！ (配置を表示)"):
+                st.session_state.game_mode = "memorizing"
+        with col2:
+            if st.button("テスト開始！ (配置を隠す)"):
+                st.session_state.game_mode = "testing"
+                st.session_state.test_logged = False
+        with col3:
+            st.button("ドリル（苦手な札から5問）", on_click=start_drill)
+
+        # 回答の記録の保存に失敗し続けているときは知らせる（たまりすぎた記録は古いものから捨てられる）
+        recall_writer = get_recall_writer()
+        if recall_writer.consecutive_failures:
+            st.warning(
+                f"回答の記録を保存できていません（{recall_writer.failures} 回失敗、未保存 {len(recall_writer.pending)} 件）: "
+                f"{recall_writer.last_error}"
+            )
+
+        # --- 暗記モード ---
+        if st.session_state.game_mode == "memorizing":
+            st.success("今のうちに配置を覚えましょう！")
+            current_kimariji = kimariji_trie.engine(all_placed_list, st.session_state.get("read_history", [])).current()
         
-        m_col_left, m_col_right = st.columns(2)
-        with m_col_left:
-            display_karuta_row("左上段", st.session_state.l_top)
-            display_karuta_row("左中段", st.session_state.l_mid)
-            display_karuta_row("左下段", st.session_state.l_low)
-        with m_col_right:
-            display_karuta_row("右上段", st.session_state.r_top)
-            display_karuta_row("右中段", st.session_state.r_mid)
-            display_karuta_row("右下段", st.session_state.r_low)
-
-    # --- テストモード ---
-    elif st.session_state.game_mode == "testing":
-        st.warning("空欄を埋めてください。")
+            m_col_left, m_col_right = st.columns(2)
+            with m_col_left:
+                display_karuta_row("左上段", st.session_state.l_top, current_kimariji)
+                display_karuta_row("左中段", st.session_state.l_mid, current_kimariji)
+                display_karuta_row("左下段", st.session_state.l_low, current_kimariji)
+            with m_col_right:
+                display_karuta_row("右上段", st.session_state.r_top, current_kimariji)
+                display_karuta_row("右中段", st.session_state.r_mid, current_kimariji)
+                display_karuta_row("右下段", st.session_state.r_low, current_kimariji)
+
+        # --- ドリルモード：苦手な札 × 段から短く出題する ---
+        elif st.session_state.game_mode == "drill":
+            drill = st.session_state.drill
+            results = st.session_state.drill_results
+            if results:
+                last = results[-1]
+                if last['correct']:
+                    st.success(f"正解！「{last['card']}」は{ZONE_LABELS[last['zone']]}です。")
+                else:
+                    st.error(f"「{last['card']}」は{ZONE_LABELS[last['zone']]}です。")
+
+            if len(results) < len(drill):
+                card, _ = drill[len(results)]
+                st.write(f"**問題 {len(results) + 1} / {len(drill)}**：「{card}」はどこに置きましたか？")
+                drill_cols = st.columns(2)
+                for z, pos in enumerate(ZONES):
+                    drill_cols[z // 3].button(
+                        ZONE_LABELS[pos], key=f"drill_{pos}", on_click=answer_drill, args=(pos,), use_container_width=True
+                    )
+            else:
+                st.metric("ドリルの正解数", f"{sum(r['correct'] for r in results)} / {len(drill)}")
+                st.button("次のドリルへ", on_click=start_drill)
+
+            weakest = get_recall_scheduler().weakest({pos: st.session_state.get(pos, []) for pos in ZONES})
+            if weakest:
+                with st.expander("苦手な札（正答率の低い順）"):
+                    st.dataframe(pd.DataFrame([
+                        {"札": w['card'], "位置": ZONE_LABELS[w['zone']], "正答率": round(w['accuracy'], 2), "回答数": w['attempts']}
+                        for w in weakest
+                    ]), hide_index=True, use_container_width=True)
+
+        # --- テストモード ---
+        elif st.session_state.game_mode == "testing":
+            st.warning("空欄を埋めてください。")
         
-        user_answers = {}
-        test_cols = st.columns(2)
+            user_answers = {}
+            test_cols = st.columns(2)
         
-        with test_cols[0]:
-            st.write("### 左側")
-            user_answers["l_top"] = st.multiselect("左上段にあるはずの札は？", options=base_options, key="ans_lt")
-            user_answers["l_mid"] = st.multiselect("左中段にあるはずの札は？", options=base_options, key="ans_lm")
-            user_answers["l_low"] = st.multiselect("左下段にあるはずの札は？", options=base_options, key="ans_ll")
-        with test_cols[1]:
-            st.write("### 右側")
-            user_answers["r_top"] = st.multiselect("右上段にあるはずの札は？", options=base_options, key="ans_rt")
-            user_answers["r_mid"] = st.multiselect("右中段にあるはずの札は？", options=base_options, key="ans_rm")
-            user_answers["r_low"] = st.multiselect("右下段にあるはずの札は？", options=base_options, key="ans_rl")
+            with test_cols[0]:
+                st.write("### 左側")
+                user_answers["l_top"] = st.multiselect("左上段にあるはずの札は？", options=base_options, key="ans_lt")
+                user_answers["l_mid"] = st.multiselect("左中段にあるはずの札は？", options=base_options, key="ans_lm")
+                user_answers["l_low"] = st.multiselect("左下段にあるはずの札は？", options=base_options, key="ans_ll")
+            with test_cols[1]:
+                st.write("### 右側")
+                user_answers["r_top"] = st.multiselect("右上段にあるはずの札は？", options=base_options, key="ans_rt")
+                user_answers["r_mid"] = st.multiselect("右中段にあるはずの札は？", options=base_options, key="ans_rm")
+                user_answers["r_low"] = st.multiselect("右下段にあるはずの札は？", options=base_options, key="ans_rl")
             
-        if st.button("答え合わせ"):
-            correct_data = {
-                "l_top": st.session_state.l_top, "l_mid": st.session_state.l_mid, "l_low": st.session_state.l_low,
-                "r_top": st.session_state.r_top, "r_mid": st.session_state.r_mid, "r_low": st.session_state.r_low
-            }
+            if st.button("答え合わせ"):
+                correct_data = {
+                    "l_top": st.session_state.l_top, "l_mid": st.session_state.l_mid, "l_low": st.session_state.l_low,
+                    "r_top": st.session_state.r_top, "r_mid": st.session_state.r_mid, "r_low": st.session_state.r_low
+                }
             
-            pos_labels = {
-                "l_top": "左上段", "l_mid": "左中段", "l_low": "左下段",
-                "r_top": "右上段", "r_mid": "右中段", "r_low": "右下段"
-            }
+                pos_labels = {
+                    "l_top": "左上段", "l_mid": "左中段", "l_low": "左下段",
+                    "r_top": "右上段", "r_mid": "右中段", "r_low": "右下段"
+                }
             
-            total_correct_count = 0
+                total_correct_count = 0
+
+                # 1枚ずつの結果を札 × 段の記録に残す（どの段に答えたか）。答え合わせを何度押しても1回のテストにつき1回だけ
+                if not st.session_state.get("test_logged"):
+                    answered_zone = {}
+                    for pos in ZONES:
+                        for fuda in user_answers[pos]:
+                            answered_zone.setdefault(fuda, pos)
+                    for pos, correct_list in correct_data.items():
+                        for fuda in correct_list:
+                            log_recall(fuda, pos, answered_zone.get(fuda))
+                    st.session_state.test_logged = True
             
-            for pos, correct_list in correct_data.items():
-                user_ans_list = user_answers[pos]
+                for pos, correct_list in correct_data.items():
+                    user_ans_list = user_answers[pos]
                 
-                # その段の正解札の集合(set)と、ユーザーの回答札の集合の「積集合（共通部分）」を取り、その数を数える
-                correct_set = set(correct_list)
-                user_set = set(user_ans_list)
+                    # その段の正解札の集合(set)と、ユーザーの回答札の集合の「積集合（共通部分）」を取り、その数を数える
+                    correct_set = set(correct_list)
+                    user_set = set(user_ans_list)
                 
-                # その段で正解した札の数
-                num_correct_in_pos = len(correct_set.intersection(user_set))
-                total_correct_count += num_correct_in_pos
+                    # その段で正解した札の数
+                    num_correct_in_pos = len(correct_set.intersection(user_set))
+                    total_correct_count += num_correct_in_pos
                 
-                # ミスがある場合だけ、どの札が足りないか、または余計かを表示する（任意）
-                if set(user_ans_list) != set(correct_list):
-                    missing = correct_set - user_set
-                    extra = user_set - correct_set
-                    error_msg = f"⚠️ {pos_labels[pos]}: "
-                    if missing:
-                        error_msg += f"不足({', '.join(missing)}) "
-                    if extra:
-                        error_msg += f"間違い({', '.join(extra)})"
-                    st.error(error_msg)
-
-            st.metric("正解した札の数", f"{total_correct_count} / 25")
+                    # ミスがある場合だけ、どの札が足りないか、または余計かを表示する（任意）
+                    if set(user_ans_list) != set(correct_list):
+                        missing = correct_set - user_set
+                        extra = user_set - correct_set
+                        error_msg = f"⚠️ {pos_labels[pos]}: "
+                        if missing:
+                            error_msg += f"不足({', '.join(missing)}) "
+                        if extra:
+                            error_msg += f"間違い({', '.join(extra)})"
+                        st.error(error_msg)
+
+                st.metric("正解した札の数", f"{total_correct_count} / 25")
             
-            if total_correct_count == 25:
-                st.balloons()
-                st.success("満点です！完璧に覚えていますね！")
-            elif total_correct_count >= 20:
-                st.info(f"あと少し（残り {25 - total_correct_count} 枚）！かなり覚えられています。")
-            else:
-                # 20枚未満の場合
-                st.warning(f"現在は {total_correct_count} 枚正解です。暗記練習をもっと頑張りましょう！")
+                if total_correct_count == 25:
+                    st.balloons()
+                    st.success("満点です！完璧に覚えていますね！")
+                elif total_correct_count >= 20:
+                    st.info(f"あと少し（残り {25 - total_correct_count} 枚）！かなり覚えられています。")
+                else:
+                    # 20枚未満の場合
+                    st.warning(f"現在は {total_correct_count} 枚正解です。暗記練習をもっと頑張りましょう！")
+
+training_phase()
+
+# --- 計測結果の表示 ---
+profiler.end_run()
+if profiler.enabled:
+    with st.sidebar.expander("⏱ 再実行プロファイラ", expanded=True):
+        records = profiler.to_records()
+        if records:
+            profile_df = pd.DataFrame(records)
+            latest = profile_df[profile_df['run'] == profile_df['run'].max()]
+            st.caption(f"直近の再実行（{latest['scope'].iloc[0]}）")
+            st.dataframe(latest[['kind', 'name', 'count', 'ms']], hide_index=True, use_container_width=True)
+            st.caption("履歴（セクション別の合計時間 ms）")
+            st.dataframe(
+                profile_df.pivot_table(index='name', columns='kind', values='ms', aggfunc='sum', fill_value=0),
+                use_container_width=True
+            )
+            st.caption("※フラグメントだけの再実行は、次にアプリ全体が再実行されたときに反映されます。")
+            dl_json, dl_csv = st.columns(2)
+            dl_json.download_button("JSON", profiler.to_json(), file_name="rerun_profile.json", mime="application/json")
+            dl_csv.download_button("CSV", profiler.to_csv(), file_name="rerun_profile.csv", mime="text/csv")